@@ -13,6 +13,7 @@ This module define all attributes of Graph/Node/Edge in dot language.
 ### 
 
 from DEUtils import resource_path
+from types import MappingProxyType
 
 E_COLORSCHEME = ['x11', 'svg']
 # Append Brewer-Color-Scheme.
@@ -238,42 +239,25 @@ GRAPH_ATTRS_DEFINE = [
 ###
 ### Some util functions to access information of attributes.
 ###
-def get_dot_attr(attr_name, g_type):
-    '''Get the attribute infomation by name and g_type. g_type should in ['node', 'group', 'graph']. Return a dict include all info.'''
-    
-    if g_type not in ['node', 'edge', 'graph']: raise Exception('g_type "%s" not valid'%g_type)
-    AD = eval(g_type.upper()+'_ATTRS_DEFINE')
+def __build_attr_index(AD):
+    '''Map each attr name in AD to its information dict. A later line overrides an earlier one.'''
     
-    result = {}
+    index = {}
     for line in AD:
-        a_name = line[0]
-        if a_name == attr_name:
-              
-            result['name']              = line[0]
-            result['default_value']     = line[1]
-            result['category']          = line[2]
-            result['group']             = line[3]
-            result['type']              = line[4]
-            result['param']             = line[5]
-            result['description']       = line[6]
-            
-    if len(result) == 0:
-        raise KeyError("Can't find the attr_name '%s' in '%s' attributes define."%(attr_name, g_type))
+        result = {}
+        result['name']              = line[0]
+        result['default_value']     = line[1]
+        result['category']          = line[2]
+        result['group']             = line[3]
+        result['type']              = line[4]
+        result['param']             = line[5]
+        result['description']       = line[6]
+        index[line[0]] = MappingProxyType(result)
     
-    return result
+    return index
 
-def get_dot_attr_structure(g_type):
-    '''
-    Put attributs structure in a dict like:{'cate1':{None:[attr_name1, attr_name2, ...], 
-                                                     'group1':[attr_name3, attr_name4], ...},
-                                            'cate2':{...},
-                                            ...}
-    Pay attention the 'None' group inclue all attr names not in any group.
-    return value is tuple(category_list, group_list, attrs_structure_dict).
-    '''
-    
-    if g_type not in ['node', 'edge', 'graph']: raise Exception('g_type "%s" not valid'%g_type)
-    AD = eval(g_type.upper()+'_ATTRS_DEFINE')
+def __build_attr_structure(AD):
+    '''Build the (category_list, group_list, attrs_structure_dict) of AD, see get_dot_attr_structure().'''
 
     ### List all category and groups, and attrs in each group.
     cates = []; groups = []; cate_dict={}; group_dict = {}
@@ -322,16 +306,51 @@ def get_dot_attr_structure(g_type):
     cates = cates[orig_len_cates-1:]
 
 
-    ### Build tree structure as result.
+    ### Build tree structure as result, frozen since it is shared by all callers.
     result = {}
     for c in cates:
         result[c] = {}
         for g in cate_dict[c]:
-            result[c][g] = group_dict[g]
+            result[c][g] = tuple(group_dict[g])
         ### Don't forget the 'cate_name_None' group.
-        result[c][None] = group_dict[c+"_None"]
+        result[c][None] = tuple(group_dict[c+"_None"])
+        result[c] = MappingProxyType(result[c])
+    
+    return tuple(cates), tuple(groups), MappingProxyType(result)
+
+### Compile the attrs define tables once, so the lookups below are just dict access.
+ATTRS_DEFINE = {'node':  NODE_ATTRS_DEFINE,
+                'edge':  EDGE_ATTRS_DEFINE,
+                'graph': GRAPH_ATTRS_DEFINE,
+                }
+ATTRS_INDEX = dict( (t, __build_attr_index(AD)) for t, AD in ATTRS_DEFINE.items() )
+ATTRS_STRUCTURE = dict( (t, __build_attr_structure(AD)) for t, AD in ATTRS_DEFINE.items() )
+
+def get_dot_attr(attr_name, g_type):
+    '''Get the attribute infomation by name and g_type. g_type should in ['node', 'group', 'graph']. Return a read-only dict include all info.'''
+    
+    if g_type not in ATTRS_INDEX: raise Exception('g_type "%s" not valid'%g_type)
+    
+    result = ATTRS_INDEX[g_type].get(attr_name)
+    if result is None:
+        raise KeyError("Can't find the attr_name '%s' in '%s' attributes define."%(attr_name, g_type))
+    
+    return result
+
+def get_dot_attr_structure(g_type):
+    '''
+    Put attributs structure in a dict like:{'cate1':{None:(attr_name1, attr_name2, ...), 
+                                                     'group1':(attr_name3, attr_name4), ...},
+                                            'cate2':{...},
+                                            ...}
+    Pay attention the 'None' group inclue all attr names not in any group.
+    return value is tuple(category_list, group_list, attrs_structure_dict), all read-only 
+    and built once at import.
+    '''
+    
+    if g_type not in ATTRS_STRUCTURE: raise Exception('g_type "%s" not valid'%g_type)
     
-    return cates, groups, result
+    return ATTRS_STRUCTURE[g_type]
 
 def __test_get_structure(g_type):
 
@@ -10,8 +10,13 @@ This module include some util functions.
 
 import csv
 from ExtParser import parse_string
-import wx
+try:
+    import wx
+except ImportError: ### Headless, e.g. batch.py, only the image functions need wx.
+    wx = None
 import os, sys, re
+import tempfile, shutil, time
+import functools, logging, logging.handlers
 import ply.lex as lex
 
 def resource_path(relative_path):
@@ -116,11 +121,42 @@ def __pos2xy(block_str, pos):
      
     return x, y
 
+### A quote, or an escaped quote (only means escaped inside a quoted string).
+quote_token_re = re.compile(r'\\"|"')
+
 def smart_indent(block_str, indent_str):
-    '''Smart add indent_str to the beginning of each line of string.'''
+    '''Smart add indent_str to the beginning of each line of string.
+    Lines starting inside a quoted string are left as they are.'''
     if len(block_str) == 0:
         return ''
     
+    # Single pass, track if each line begins inside a quoted string.
+    result = []
+    in_quote = False
+    for l in block_str.split('\n'):
+        if in_quote:
+            result.append(l)
+        else:
+            result.append(indent_str + l)
+        
+        for m in quote_token_re.finditer(l):
+            if m.group() == '"' or not in_quote:
+                in_quote = not in_quote
+    
+    # An unclosed quote, let the lexer decide where the quoted strings are.
+    if in_quote:
+        return __smart_indent_by_lexer(block_str, indent_str)
+    
+    result = '\n'.join(result)
+    
+    if block_str[-1] == '\n':
+        result += '\n'
+        
+    return result
+
+def __smart_indent_by_lexer(block_str, indent_str):
+    '''Same as smart_indent(), but find the quoted strings by a PLY lexer.'''
+    
     # Build a lexer.
     tokens = ('QUOTED_STRING',)
     t_QUOTED_STRING =  r'(\"(\\"|[^"])*?\")'
@@ -197,8 +233,13 @@ digraph G {
         
     return
 
-def get_colors_in_scheme(scheme_name):
-    ### Build dict of scheme.
+### Colors of each scheme as {scheme_name:{color_name:(r,g,b)}} and the reverse 
+### {scheme_name:{(r,g,b):color_name}}, both filled at the 1st use of a scheme.
+COLOR_DB = {}
+COLOR_NAME_DB = {}
+
+def __load_color_scheme(scheme_name):
+    '''Read colors of scheme_name into COLOR_DB. All colorbrewer schemes are read in one go.'''
     # X11.
     if scheme_name == 'x11':
         in_f = open(resource_path('resource/color_scheme/rgb.txt'))
@@ -212,8 +253,9 @@ def get_colors_in_scheme(scheme_name):
             r,g,b = map(int, [c[:3], c[4:7], c[8:]])
             c_name = line[11:].strip()
             x11_dict[c_name] = (r,g,b)
+        in_f.close()
             
-        return x11_dict
+        COLOR_DB['x11'] = x11_dict
 
     # Svg.
     elif scheme_name == 'svg':
@@ -224,7 +266,7 @@ def get_colors_in_scheme(scheme_name):
             svg_dict[row[0]] = tuple(map(int, row[1:]))
         in_f.close()
     
-        return svg_dict
+        COLOR_DB['svg'] = svg_dict
 
     # Colorbrewer.
     else:
@@ -240,9 +282,29 @@ def get_colors_in_scheme(scheme_name):
         
         in_f.close()
         
-        return all_cb_dict[scheme_name]
+        COLOR_DB.update(all_cb_dict)
         
-    return None
+    return
+
+def get_colors_in_scheme(scheme_name):
+    '''Return the dict {color_name:(r,g,b)} of scheme_name. The dict is shared, don't modify it.'''
+    
+    if not scheme_name in COLOR_DB:
+        __load_color_scheme(scheme_name)
+        
+    return COLOR_DB[scheme_name]
+
+def get_color_name(rgb, scheme_name='x11'):
+    '''Return the name of color rgb(r,g,b) in scheme_name, the 1st one if several. None if not found.'''
+    
+    name_dict = COLOR_NAME_DB.get(scheme_name)
+    if name_dict is None:
+        name_dict = {}
+        for c_name, c_rgb in get_colors_in_scheme(scheme_name).items():
+            name_dict.setdefault(c_rgb, c_name)
+        COLOR_NAME_DB[scheme_name] = name_dict
+        
+    return name_dict.get(tuple(rgb[:3]))
 
 def get_image_resource(item_type, attr_name, value_str):
     '''Get image resouce by item_type(in ['node', 'edge', 'graph']), attr_name and value_str(in enum list).'''
@@ -260,35 +322,335 @@ def get_image_resource(item_type, attr_name, value_str):
         return img
     return None
 
+def get_max_image_size(image_list):
+    '''Return (max_w, max_h) of all images in image_list.'''
+    max_w, max_h = (0,0)
+    for img in image_list:
+        w,h = img.GetSize()
+        if w > max_w: max_w = w
+        if h > max_h: max_h = h
+        
+    return max_w, max_h
+
+def normalize_image(img, max_w, max_h):
+    '''Center img in a max_w*max_h image, return img itself if already in that size.'''
+    w,h = img.GetSize()
+    if w==max_w and h==max_h:
+        return img
+    
+    pos_x = int((max_w-w)/2)
+    pos_y = int((max_h-h)/2)
+
+    new_img = wx.Image(max_w, max_h)
+    new_img.Clear()
+    new_img.Paste(img, pos_x, pos_y)
+    
+    return new_img
+
 def normalize_imglist(image_list):
     '''
     Make image in list to the same size. 
     The image_list should be a list of wxBitmap.
     Return a wxImageList as result.
     '''
-    max_w, max_h = (0,0)
-    for img in image_list:
-        w,h = img.GetSize()
-        if w > max_w: max_w = w
-        if h > max_h: max_h = h
+    max_w, max_h = get_max_image_size(image_list)
     
     il = wx.ImageList(max_w, max_h)
     
     for img in image_list:
-        w,h = img.GetSize()
-        if w==max_w and h==max_h:
-            il.Add(img.ConvertToBitmap())
-        else:
-            pos_x = int((max_w-w)/2)
-            pos_y = int((max_h-h)/2)
+        il.Add(normalize_image(img, max_w, max_h).ConvertToBitmap())
+    
+    return il
+
+### Images of a category packed in one pre-normalized atlas, generated by tools.py.
+### The index file has a line "value,x,y,w,h" for each image in the atlas.
+IMAGE_CATEGORY = {('node', 'shape'):        'node_shape',
+                  ('edge', 'arrowhead'):    'edge_arrowtype',
+                  ('edge', 'arrowtail'):    'edge_arrowtype',
+                  (None,   'colorscheme'):  'palette',
+                  }
+SPRITE_FILE = 'resource/sprite/%s.png'
+SPRITE_INDEX_FILE = 'resource/sprite/%s.csv'
+
+def read_sprite_index(category):
+    '''Return the dict {value:(x,y,w,h)} of the atlas of category, None if no atlas.'''
+    fn = resource_path(SPRITE_INDEX_FILE%category)
+    if not os.path.isfile(fn) or not os.path.isfile(resource_path(SPRITE_FILE%category)):
+        return None
+    
+    index = {}
+    in_f = open(fn)
+    cr = csv.reader(in_f, delimiter=',')
+    for row in cr:
+        index[row[0]] = tuple(map(int, row[1:5]))
+    in_f.close()
     
-            new_img = wx.Image(max_w, max_h)
-            new_img.Clear()
-            new_img.Paste(img, pos_x, pos_y)
-            il.Add(new_img.ConvertToBitmap())
+    return index
+
+def load_sprite_list(category, values):
+    '''Slice the atlas of category into a wxImageList of values. Return None if 
+    there is no atlas or it misses some of values, e.g. not generated again 
+    after a new enum value added.'''
+    index = read_sprite_index(category)
+    if index is None:
+        return None
+    
+    rects = []
+    for v in values:
+        if not v in index:
+            return None
+        rects.append(index[v])
+    
+    if len(rects) == 0 or len(set( r[2:] for r in rects )) > 1:
+        return None
+    
+    atlas = wx.Image(resource_path(SPRITE_FILE%category))
+    if not atlas.IsOk():
+        return None
+    
+    _, _, w, h = rects[0]
+    il = wx.ImageList(w, h)
+    for x, y, w, h in rects:
+        il.Add(atlas.GetSubImage(wx.Rect(x, y, w, h)).ConvertToBitmap())
     
     return il
 
+def load_image_list(item_type, attr_name, values):
+    '''Load the images of all values into a normalized wxImageList. Slice them from 
+    the sprite atlas if there is, else read them one by one by get_image_resource().'''
+    
+    category = IMAGE_CATEGORY.get((item_type, attr_name))
+    if not category is None:
+        il = load_sprite_list(category, values)
+        if not il is None:
+            return il
+    
+    img_list = [ get_image_resource(item_type, attr_name, v) for v in values ]
+    
+    return normalize_imglist(img_list)
+
+### Backups of a saved file, the newest first: 'backup_1_a.dot', 'backup_2_a.dot'...
+BACKUP_FILE = 'backup_%d_%s'
+### Backups kept for each file at most, and the total size of them.
+BACKUP_COUNT = 5
+BACKUP_SIZE = 50*1024*1024
+
+def __rotate_backups(fp, count=BACKUP_COUNT, size=BACKUP_SIZE):
+    '''Keep the current content of fp as the 1st backup and shift the older ones, 
+    drop those beyond count or beyond size in total. The backup is a hard link of 
+    fp when the filesystem allows, so the old content is never copied.'''
+    
+    pn, fn = os.path.split(fp)
+    backups = [ os.path.join(pn, BACKUP_FILE%(i, fn)) for i in range(1, count+1) ]
+    
+    if os.path.isfile(backups[-1]):
+        os.remove(backups[-1])
+    for i in range(count-1, 0, -1):
+        if os.path.isfile(backups[i-1]):
+            os.replace(backups[i-1], backups[i])
+    
+    try:
+        os.link(fp, backups[0])
+    except (OSError, AttributeError):
+        shutil.copy2(fp, backups[0])
+    
+    total = 0
+    for i, b in enumerate(backups):
+        if not os.path.isfile(b):
+            continue
+        total += os.path.getsize(b)
+        if i > 0 and total > size:
+            os.remove(b)
+    
+    return
+
+def atomic_save(fp, write_func, backup=True):
+    '''Save fp by write_func(f) on a temp file next to it, which replaces fp only 
+    after being written and synced to disk. So a failed save never leaves fp 
+    truncated. The old content is kept by __rotate_backups() if backup.'''
+    
+    fp = os.path.abspath(fp)
+    pn, fn = os.path.split(fp)
+    
+    fd, temp_fp = tempfile.mkstemp(prefix='.%s.'%fn, suffix='.tmp', dir=pn)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write_func(f)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        if os.path.isfile(fp):
+            shutil.copymode(fp, temp_fp)
+            if backup:
+                __rotate_backups(fp)
+        else: ### mkstemp() makes it owner only, a new file follows the umask as by open().
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_fp, 0o666 & ~umask)
+        
+        os.replace(temp_fp, fp)
+    except:
+        if os.path.exists(temp_fp):
+            os.remove(temp_fp)
+        raise
+    
+    ### Make the rename itself durable.
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(pn, os.O_RDONLY|os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    return
+
+### Timers of the functions wrapped by instrument(), name -> [calls, total, last, max] in seconds.
+PERF_STATS = {}
+### Every call timed is logged here when log_perf() is on, rolling over at PERF_LOG_SIZE bytes.
+PERF_LOG_FILE = os.path.join(os.path.expanduser('~'), '.DotEditor', 'perf.log')
+PERF_LOG_SIZE = 1024*1024
+perf_logger = logging.getLogger('DotEditor.perf')
+
+def instrument(owner, attr, name=None):
+    '''Replace the function attr of owner(class or module) by one timing its calls
+    into PERF_STATS[name]. Nothing is wrapped until it's called, so the timers 
+    cost nothing when they are off. Private methods are given by the mangled name, 
+    e.g. "_MF__zoom_img".'''
+    
+    func = getattr(owner, attr)
+    if name is None:
+        name = attr.split('__')[-1]
+    stat = PERF_STATS.setdefault(name, [0, 0.0, 0.0, 0.0])
+    
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            dt = time.perf_counter() - t
+            stat[0] += 1; stat[1] += dt; stat[2] = dt
+            if dt > stat[3]:
+                stat[3] = dt
+            perf_logger.debug('%s %.6f', name, dt)
+    
+    setattr(owner, attr, timed)
+    
+    return
+
+def log_perf(fp=PERF_LOG_FILE, max_bytes=PERF_LOG_SIZE):
+    '''Log the timed calls into fp, keep one older file when it rolls over.'''
+    
+    pn = os.path.dirname(fp)
+    if not os.path.isdir(pn):
+        os.makedirs(pn)
+    
+    handler = logging.handlers.RotatingFileHandler(fp, maxBytes=max_bytes, backupCount=1)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    perf_logger.addHandler(handler)
+    perf_logger.setLevel(logging.DEBUG)
+    perf_logger.propagate = False
+    
+    return
+
+def perf_summary(names=None):
+    '''A line of the last time of names, all the timers if None, e.g. 
+    "refresh_bitmap 120ms (3)", the calls so far in brackets.'''
+    
+    if names is None:
+        names = sorted(PERF_STATS)
+    
+    items = []
+    for n in names:
+        calls, _, last, _ = PERF_STATS.get(n, (0, 0.0, 0.0, 0.0))
+        if calls:
+            items.append('%s %dms (%d)'%(n, last*1000, calls))
+    
+    return ' | '.join(items)
+
+def perf_report():
+    '''Lines of calls, total, mean and max time of every timer.'''
+    
+    lines = ['%-20s %8s %10s %10s %10s'%('timer', 'calls', 'total ms', 'mean ms', 'max ms')]
+    for n in sorted(PERF_STATS):
+        calls, total, _, max_t = PERF_STATS[n]
+        if calls:
+            lines.append('%-20s %8d %10.1f %10.2f %10.2f'%(n, calls, total*1000, total*1000/calls, max_t*1000))
+    
+    return '\n'.join(lines)
+
+def __bench_image_lists():
+    '''Time building the image lists of the pg dialogs, the startup cost paid 
+    before the 1st paint when they were loaded eagerly in MF.__init__.'''
+    import time
+    import AttrsDef
+    
+    def load_files(item_type, attr_name, values):
+        return normalize_imglist([ get_image_resource(item_type, attr_name, v) for v in values ])
+    
+    app = wx.App(False)
+    for name, func in [('files', load_files), ('atlas', load_image_list)]:
+        total = 0
+        for item_type, attr_name, values in [(None,   'colorscheme', AttrsDef.E_COLORSCHEME),
+                                             ('node', 'shape',       AttrsDef.E_SHAPE),
+                                             ('edge', 'arrowhead',   AttrsDef.E_ARROWTYPE)]:
+            t = time.time()
+            func(item_type, attr_name, values)
+            dt = time.time() - t
+            total += dt
+            print('%s: image list %-12s %4d images %8.1f ms'%(name, attr_name, len(values), dt*1000))
+        print('%s: image lists total %8.1f ms'%(name, total*1000))
+    
+    app.Destroy()
+    
+    return
+
+def __bench_smart_indent(sizes=(500, 1000, 2000, 4000)):
+    '''Time indenting graphs with multiline labels, as EG_to_string does
+    on save. The cost per node should stay flat when the graph grows.'''
+    import time
+    
+    label = '"line one\nline \\"two\\"\n    line three"'
+    for n in sizes:
+        nodes = [ 'n%d [label=%s, shape=box];'%(i, label) for i in range(n) ]
+        
+        for name, func in [('single pass', smart_indent), 
+                           ('lexer', __smart_indent_by_lexer)]:
+            t = time.time()
+            for node_str in nodes:
+                func(node_str, ' '*4)
+            t = time.time() - t
+            print('%-12s %6d nodes: %8.3fs, %6.1fus/node'%(name, n, t, t*1e6/n))
+    
+    return
+
+def __bench_quote_if_necessary(n=200000):
+    '''Time pydot.quote_if_necessary on values distributed like the ones of 
+    real graphs: few distinct attribute values, many distinct node names.'''
+    import time, random
+    import pydot
+    
+    random.seed(0)
+    values = ['black', 'lightgrey', '#ff8800', '14', '0.75', 'box', 'filled,rounded',
+              'serif', 'Times-Roman', '"already quoted"', 'a label with spaces', 
+              'line1\nline2', '<<b>html</b>>', 'node:n', 'true', 'LR', u'हिंदी']
+    samples = []
+    for i in range(n):
+        if i%4 == 0: ### Names and edge end points.
+            samples.append('node_%d'%random.randint(0, n//8))
+        else:
+            samples.append(random.choice(values))
+    
+    pydot.needs_quotes.cache_clear(); pydot._quote_str.cache_clear()
+    for name in ['cold memo', 'warm memo']:
+        t = time.time()
+        for v in samples:
+            pydot.quote_if_necessary(v)
+        t = time.time() - t
+        print('%-12s %6d values: %8.3fs, %6.2fus/value'%(name, n, t, t*1e6/n))
+    
+    return
+
 if __name__ == '__main__':
     s = r'''
 AAAA
@@ -301,6 +663,10 @@ ABCD"
     '''
     print(len(smart_indent(s, ' '*4)))
     
+    __bench_smart_indent()
+    __bench_quote_if_necessary()
+    __bench_image_lists()
+    
         
     #print gen_CB_palette_img('PuBu')
     
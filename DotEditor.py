@@ -15,9 +15,16 @@ The graph core module "ExtGraph.py" base on the PyDot project. (https://github.c
 To modified the attributes define of dot language, edit the "AttrsDef.py".
 '''
 
-import os, wx, types, time, shutil, math
+import time
+STARTUP_TIMES = [('start', time.time())] ### (phase, end time) of startup phases, see mark_startup().
+import os, wx, types, math
+import threading, queue
+from collections import OrderedDict
 import wx.propgrid as wxpg
+STARTUP_TIMES.append(('import wx', time.time()))
 import ExtGraph as ExtGraph
+import pydot
+STARTUP_TIMES.append(('import graph modules', time.time()))
 
 from UIClass import MainFrame, DialogAppend, DialogAbout, DialogGraphSetting, \
                     DialogHelp
@@ -27,8 +34,10 @@ import AttrsDef
 import ExtPG
 from builtins import isinstance
 from DEUtils import add_double_quote, to_unicode, remove_double_quote ,\
-                    normalize_imglist, get_image_resource, resource_path,\
-                    escape_dot_string
+                    load_image_list, resource_path,\
+                    escape_dot_string, atomic_save
+import DEUtils
+STARTUP_TIMES.append(('import ui modules', time.time()))
 
 ### The layout command and export format wildcard define. 
 ### The "osage", "sfdp" commands are not here because the pydot module has missed them.
@@ -39,8 +48,66 @@ G_FORMAT_WILDCARD = "Portable Network Graphics format (*.png)|*.png"+\
                     "|Scalable Vector Graphics (*.svg)|*.svg"+\
                     "|PostScript Format (*.ps)|*.ps"+\
                     "|PostScript for PDF (*.ps2)|*.ps2"+\
-                    "|GIF Format (*.gif)|*.gif"
-
+                    "|GIF Format (*.gif)|*.gif"+\
+                    "|PNG, SVG and PDF at once (*.png;*.svg;*.pdf)|*.png;*.svg;*.pdf"
+### Formats of the last item of G_FORMAT_WILDCARD.
+G_FORMAT_BATCH = ['png', 'svg', 'pdf']
+
+### The m_tree spreads the items of a graph a page at a time, the rest behind a
+### "more" item. Subgraphs spread when expanded, only a few are expanded at start.
+TREE_PAGE_SIZE = 1000
+TREE_EXPAND_LIMIT = 2000
+
+### The image lists used by the pg dialogs, key -> (item_type, attr_name, values).
+### They are built on 1st use or when the app is idle, see MF.get_image_list().
+IMAGE_LIST_DEFINE = {'colorscheme': (None,   'colorscheme', AttrsDef.E_COLORSCHEME),
+                     'node_shape':  ('node', 'shape',       AttrsDef.E_SHAPE),
+                     'arrow_style': ('edge', 'arrowhead',   AttrsDef.E_ARROWTYPE),
+                     }
+
+### Max names listed in a combobox dropdown, others are reached by autocomplete.
+SUGGESTION_LIMIT = 500
+
+### Run with "--profile-startup" to print the time of each startup phase.
+PROFILE_STARTUP = '--profile-startup' in os.sys.argv
+### Run with "--profile-perf" to time the hot paths, see enable_perf().
+PROFILE_PERF = '--profile-perf' in os.sys.argv
+### Interval of the timers readout in the status bar, ms.
+PERF_READOUT_INTERVAL = 1000
+
+def mark_startup(phase):
+    '''Record the end of a startup phase.'''
+    STARTUP_TIMES.append((phase, time.time()))
+
+def report_startup():
+    '''Print the time of each startup phase recorded by mark_startup().'''
+    t0 = STARTUP_TIMES[0][1]
+    last = t0
+    print('%-32s %10s %10s'%('startup phase', 'ms', 'total ms'))
+    for phase, t in STARTUP_TIMES[1:]:
+        print('%-32s %10.1f %10.1f'%(phase, (t-last)*1000, (t-t0)*1000))
+        last = t
+
+
+def enable_perf():
+    '''Time the hot paths of rendering and UI refresh, the timers show in the status 
+    bar and the calls are logged into DEUtils.PERF_LOG_FILE. Call it before MF is 
+    created, for the event handlers are bound to its methods then.'''
+    
+    for owner, attr in [(ExtGraph.ExtGraph, 'refresh_bitmap'),
+                        (pydot.Dot,         'create'),
+                        (pydot,             'call_graphviz'),
+                        (ExtParser,         'parse_string'),
+                        (MF,                '_MF__zoom_img'),
+                        (MF,                '_MF__spread_tree'),
+                        (MF,                '_MF__sync_tree'),
+                        (MF,                'onItemSelected'),
+                        ]:
+        DEUtils.instrument(owner, attr)
+    
+    DEUtils.log_perf()
+    
+    return
 
 class DH(DialogHelp):
     '''A dialog to show help graph :) '''
@@ -90,40 +157,49 @@ class DH(DialogHelp):
         
         return
 
+class NameCompleter(wx.TextCompleterSimple):
+    '''Autocomplete a text entry by function get_names(prefix), which returns a name list.'''
+    
+    def __init__(self, get_names):
+        wx.TextCompleterSimple.__init__(self)
+        self.get_names = get_names
+    
+    def GetCompletions(self, prefix):
+        if prefix.strip() == '':
+            return []
+        return self.get_names(prefix)
+
 class DA(DialogAppend):
     '''Append item dialog.'''
     def __init__(self, parent):
         DialogAppend.__init__(self, parent)
         self.data_graph = parent.data_graph
+        self.index = self.data_graph.EG_get_index()
         self.__refresh_comboBoxA_suggestion()
         
+        ### Suggest all names in graph when typing.
+        for cb in [self.m_comboBox_nodeA, self.m_comboBox_nodeB]:
+            cb.AutoComplete(NameCompleter(lambda prefix: self.index.find_names(prefix, SUGGESTION_LIMIT)))
+        
         self.m_comboBox_nodeA.SetFocus()
     
     def __refresh_comboBoxA_suggestion(self):
         '''Refresh comboxA, filled it with suggested node name.'''
-        nodes = self.data_graph.EG_get_all_node_names()
-        edges = self.data_graph.EG_get_all_edge_names()
-        
-        endpoints = set()
-        for s, d in edges:
-            endpoints.add(s); endpoints.add(d)
+        index = self.index
         
         ### Generate suggestion when Appending Node.
         if self.m_radioBox_type.GetSelection() in [0,3]:
             # All end node but the stand-alone one.
-            s_n = list(endpoints - set(nodes))
+            s_n = [ n for n in index.endpoints if not n in index.nodes ]
         
         ### Generate suggestion when Appending Edge.
         else:
             # Get all node name in graph. Include all end-nodes in edges. 
-            s_n = sorted(list( set(nodes).union(endpoints) ))
+            s_n = index.get_all_node_names()
       
         # Save the value in old_v.
         old_v = self.m_comboBox_nodeA.GetValue()
-        self.m_comboBox_nodeA.Clear()
-        # s_n.sort()
-        for n in s_n:
-            self.m_comboBox_nodeA.Append(n)
+        self.m_comboBox_nodeA.Set(s_n[:SUGGESTION_LIMIT])
         
         # Restore the nodeA value.
         self.m_comboBox_nodeA.SetValue(old_v)
@@ -182,30 +258,15 @@ class DA(DialogAppend):
             self.m_comboBox_nodeB.Clear()
             return
             
-        nodes = self.data_graph.EG_get_all_node_names()
-        edges = self.data_graph.EG_get_all_edge_names()
-        endpoints = set()
-        for s, d in edges:
-            endpoints.add(s); endpoints.add(d)
-        
         nA = self.m_comboBox_nodeA.GetValue().strip()
         
-        # Get all node's name.
-        s_n = set(nodes).union(endpoints)  
-        invalid_points = set()
-        for s,d in edges:
-            if s == nA:
-                invalid_points.add(d)
-                     
-        s_n = s_n - invalid_points 
-        s_n = sorted(list(s_n))
-        # s_n.sort()
+        # Get all node's name, but the ones nodeA already links to.
+        invalid_points = self.index.targets.get(nA, {})
+        s_n = [ n for n in self.index.get_all_node_names() if not n in invalid_points ]
         
         # Save the value in old_v.
         old_v = self.m_comboBox_nodeB.GetValue()
-        self.m_comboBox_nodeB.Clear()
-        for n in s_n:
-            self.m_comboBox_nodeB.Append(n)
+        self.m_comboBox_nodeB.Set(s_n[:SUGGESTION_LIMIT])
         
         # Restore the nodeA value.
         self.m_comboBox_nodeB.SetValue(old_v)
@@ -311,6 +372,181 @@ class DGS(DialogGraphSetting):
         self.m_choice_layout_cmd.SetSelection(G_CMDS.index(g.prog))
         
 
+class ExportQueue(object):
+    '''Export jobs run one by one in a worker thread. A job lays the script out 
+    once (or takes the layout given, or the one of the same script from the cache) 
+    and outputs all of its formats from that layout. Progress goes to notify(job, 
+    done, total, error) in the UI thread, done == total when the job ends. The 
+    jobs not ended are kept by self.unfinished, guarded by self.lock as both 
+    threads change it.'''
+    
+    ### Layouts kept by (script, prog).
+    LAYOUT_CACHE_SIZE = 4
+    
+    def __init__(self, notify):
+        self.notify = notify
+        self.jobs = queue.Queue()
+        self.layouts = OrderedDict()
+        self.lock = threading.Lock()
+        self.unfinished = []
+        self.thread = None
+    
+    def get_pending(self):
+        '''Number of the jobs queued or running.'''
+        with self.lock:
+            return len(self.unfinished)
+    
+    def put(self, script, prog, paths, layout=None, shape_files=()):
+        '''Queue the export of script by prog into paths, the format of each path
+        is given by its extension. If layout(xdot of the script by prog) is given, 
+        script is not laid out again and may be None. Return the job, to be passed 
+        to cancel().'''
+        
+        job = {'script':script, 'prog':prog, 'paths':list(paths), 'layout':layout, 
+               'shape_files':list(shape_files), 'cancel':threading.Event()}
+        with self.lock:
+            self.unfinished.append(job)
+        self.jobs.put(job)
+        
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.__run)
+            self.thread.daemon = True
+            self.thread.start()
+        
+        return job
+    
+    def cancel(self, job=None):
+        '''Cancel job, or all the jobs if None. The graphviz of the running job is 
+        killed, the queued ones end as cancelled once taken by the worker.'''
+        
+        with self.lock:
+            if job is None:
+                jobs = list(self.unfinished)
+            else:
+                jobs = [job]
+            for j in jobs:
+                j['cancel'].set()
+        
+        return
+    
+    def __get_layout(self, job):
+        
+        if not job['layout'] is None:
+            return job['layout']
+        
+        key = (job['script'], job['prog'])
+        layout = self.layouts.pop(key, None)
+        if layout is None:
+            layout = ExtGraph.layout_script(job['script'], job['prog'], cancel=job['cancel'], 
+                                            shape_files=job['shape_files'])
+        self.layouts[key] = layout
+        while len(self.layouts) > self.LAYOUT_CACHE_SIZE:
+            self.layouts.popitem(last=False)
+        
+        return layout
+    
+    def __run(self):
+        
+        while True:
+            job = self.jobs.get()
+            
+            total = len(job['paths']) + 1
+            done, error = 0, None
+            try:
+                if job['cancel'].is_set(): ### Cancelled while queued.
+                    raise Exception('Cancelled')
+                layout = self.__get_layout(job)
+                done += 1
+                for fp in job['paths']:
+                    wx.CallAfter(self.notify, job, done, total, None)
+                    data = ExtGraph.render_layout(layout, os.path.splitext(fp)[1][1:].lower(), 
+                                                  cancel=job['cancel'], shape_files=job['shape_files'])
+                    with open(fp, 'wb') as f:
+                        f.write(data)
+                    done += 1
+            except Exception as ex:
+                error = str(ex)
+            if job['cancel'].is_set():
+                error = 'Cancelled'
+            
+            with self.lock:
+                self.unfinished.remove(job)
+            wx.CallAfter(self.notify, job, total, total, error)
+
+class PreviewRenderer(object):
+    '''Previews are rendered one at a time in a worker thread. A new one 
+    supersedes the one being rendered, whose graphviz is killed, so only the 
+    last edit is waited for. A job with a draft prog renders the draft first.
+    Results go to notify(job, data, stats, error, draft, layout) in the UI thread, 
+    the superseded ones and the failed drafts never. The full preview is laid out 
+    into xdot, kept as layout for exports, and the png is output from it.'''
+    
+    def __init__(self, notify, timeout=ExtGraph.RENDER_TIMEOUT):
+        self.notify = notify
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.job = None
+        self.next_job = None
+        self.thread = None
+    
+    def submit(self, graph, key, prog, script, counts, draft_prog=None):
+        '''Render script by prog for graph, see ExtGraph.ExtGraph.__init__().'''
+        
+        job = {'graph':graph, 'key':key, 'prog':prog, 'script':script, 
+               'counts':counts, 'draft':draft_prog, 'shape_files':list(graph.shape_files), 
+               'cancel':threading.Event()}
+        with self.lock:
+            if not self.next_job is None:
+                self.next_job['cancel'].set()
+            if not self.job is None:
+                self.job['cancel'].set()
+            self.next_job = job
+        self.wakeup.set()
+        
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.__run)
+            self.thread.daemon = True
+            self.thread.start()
+        
+        return
+    
+    def __run(self):
+        
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                self.wakeup.clear()
+                job, self.next_job = self.next_job, None
+                self.job = job
+            if job is None:
+                continue
+            
+            steps = [(job['prog'], False)]
+            if not job['draft'] is None:
+                steps.insert(0, (job['draft'], True))
+            
+            for prog, draft in steps:
+                data = layout = stats = error = None
+                try:
+                    if draft: ### Its layout is of no use later.
+                        data, stats = ExtGraph.render_script_stats(job['script'], prog[0], 'png', prog[1:], 
+                                                                   timeout=self.timeout, cancel=job['cancel'],
+                                                                   shape_files=job['shape_files'])
+                    else:
+                        data, layout, stats = ExtGraph.render_preview(job['script'], prog, self.timeout, 
+                                                                      job['cancel'], job['shape_files'])
+                except Exception as ex:
+                    error = str(ex)
+                
+                if job['cancel'].is_set():
+                    break
+                if not (draft and error):
+                    wx.CallAfter(self.notify, job, data, stats, error, draft, layout)
+            
+            with self.lock:
+                self.job = None
+
 class MF(MainFrame):
     
     is_data_changed = False
@@ -323,6 +559,7 @@ class MF(MainFrame):
     
     def __init__(self, parent=None):
         MainFrame.__init__(self, parent)
+        mark_startup('MainFrame layout')
         
         # Set icon of buttons. (Cause of the resource path problem in pyinstaller~~~)
         for btn_name in ['new', 'open', 'save', 'export', 'script', 'add', 'minus', 'graphsetting', 'help', 'copy']:
@@ -334,25 +571,10 @@ class MF(MainFrame):
         # Set icon.
         self.SetIcon(wx.Icon(resource_path('resource/icon/DE.ico'), wx.BITMAP_TYPE_ICO))    
         self.colorDB = wx.ColourDatabase()
+        mark_startup('button icons')
     
-        # Build help popmenu.
-        self.m_menu_help = wx.Menu()
-        
-        help_list = []
-        help_files = os.listdir(resource_path('resource/help/'))
-        for hf in help_files:
-            if hf[0].isdigit() and hf[-3:].lower() == 'dot':
-                help_list.append(hf[:-4])
-        
-        for item in help_list:
-            m_id = wx.NewIdRef()
-            self.m_menu_help.Append(m_id, item)
-            self.m_menu_help.Bind(wx.EVT_MENU, self.onHelpMenu, id=m_id )
-            
-        self.m_menu_help.AppendSeparator()
-        m_id = wx.NewIdRef()
-        self.m_menu_help.Append(m_id, '&About')
-        self.m_menu_help.Bind(wx.EVT_MENU, self.onAbout, id=m_id )
+        # Help popmenu is built after the 1st frame, see __build_help_menu().
+        self.m_menu_help = None
     
         ### Init some icon in m_tree.
         iList = wx.ImageList(16,16)
@@ -369,25 +591,53 @@ class MF(MainFrame):
         
         self.m_tree.AssignImageList(iList)
         
-        ### Init some image list used in pg. --------------------------------------
+        ### Find box above m_tree, search node by name or label.
+        self.m_search_tree = wx.SearchCtrl(self.m_tree.GetParent(), style=wx.TE_PROCESS_ENTER)
+        self.m_search_tree.SetDescriptiveText('Find node by name or label')
+        self.m_search_tree.AutoComplete(NameCompleter(self.__find_tree_names))
+        sizer = self.m_tree.GetContainingSizer()
+        sizer.SetRows(sizer.GetRows()+1)
+        sizer.RemoveGrowableRow(1)
+        sizer.Insert(1, self.m_search_tree, 0, wx.ALL|wx.EXPAND, 2)
+        sizer.AddGrowableRow(2)
+        self.m_tree.GetParent().Layout()
+        self.m_search_tree.Bind(wx.EVT_TEXT_ENTER, self.onFindInTree)
+        self.m_search_tree.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.onFindInTree)
+        self.find_state = ('', 0)
+        mark_startup('tree icons')
+        
+        ### Image lists used in pg, built lazily. ---------------------------------
         self.image_list = {}
-        # Load colorscheme.
-        img_list = [ get_image_resource(None, 'colorscheme', cs) for cs in AttrsDef.E_COLORSCHEME ]
-        self.image_list['colorscheme'] = normalize_imglist(img_list)
-        
-        # Load node shape.
-        img_list = [ get_image_resource('node', 'shape', ns) for  ns in AttrsDef.E_SHAPE ]
-        self.image_list['node_shape'] = normalize_imglist(img_list)
-        
-        # Load arrow style.
-        img_list = [ get_image_resource('edge', 'arrowhead', es) for  es in AttrsDef.E_ARROWTYPE ]
-        self.image_list['arrow_style'] = normalize_imglist(img_list)  
                         
-        ### Init graph. -----------------------------------------------------------
-        self.update_graph( ExtGraph.ExtGraph('G') )          
+        if PROFILE_PERF:
+            self.CreateStatusBar(2)
+            self.GetStatusBar().SetStatusWidths([-1, -2])
+            self.perf_timer = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER, self.onPerfReadout, self.perf_timer)
+            self.perf_timer.Start(PERF_READOUT_INTERVAL)
+        else:
+            self.CreateStatusBar()
+        self.export_queue = ExportQueue(self.onExportProgress)
+        self.preview_renderer = PreviewRenderer(self.onPreviewRendered)
+        ### Preview the subgraph of the selected item alone, see onToggleFocus().
+        self.focus_mode = False
+        
+        ### Work deferred to idle time after the 1st frame, in order, one task per idle event.
+        self.startup_tasks = [('initial graph', self.__init_graph), 
+                              ('help menu', self.__build_help_menu)]
+        for key in IMAGE_LIST_DEFINE:
+            self.startup_tasks.append(('image list %s'%key, lambda key=key: self.get_image_list(key)))
+        self.Bind(wx.EVT_IDLE, self.onIdleStartup)
         
         ### Register hotkey.
-        self.accel_tb = wx.AcceleratorTable([(wx.ACCEL_CTRL, ord('n'), self.m_bpButton_new.GetId()),
+        self.id_undo = wx.NewIdRef()
+        self.id_redo = wx.NewIdRef()
+        self.id_focus = wx.NewIdRef()
+        self.accel_tb = wx.AcceleratorTable([(wx.ACCEL_ALT, ord('f'), self.id_focus),
+                                             (wx.ACCEL_CTRL, ord('z'), self.id_undo),
+                                             (wx.ACCEL_CTRL, ord('y'), self.id_redo),
+                                             (wx.ACCEL_CTRL|wx.ACCEL_SHIFT, ord('z'), self.id_redo),
+                                             (wx.ACCEL_CTRL, ord('n'), self.m_bpButton_new.GetId()),
                                              (wx.ACCEL_CTRL, ord('o'), self.m_bpButton_open.GetId()),
                                              (wx.ACCEL_CTRL, ord('s'), self.m_bpButton_save.GetId()),
                                              (wx.ACCEL_CTRL|wx.ACCEL_SHIFT, ord('s'), self.m_button_save_as.GetId()),
@@ -411,48 +661,353 @@ class MF(MainFrame):
         self.m_panel_paint.Bind(wx.EVT_LEFT_DOWN, self.onLeftButtonDown)
         
         self.Bind(wx.EVT_CLOSE, self.onClose)
+        self.Bind(wx.EVT_MENU, self.onUndo, id=self.id_undo)
+        self.Bind(wx.EVT_MENU, self.onRedo, id=self.id_redo)
+        self.Bind(wx.EVT_MENU, self.onToggleFocus, id=self.id_focus)
+        self.Bind(wx.EVT_CHAR_HOOK, self.onCancelExport)
+        self.m_tree.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.onTreeExpanding)
         self.m_pgManager1.Bind(wxpg.EVT_PG_SELECTED, self.onPGActive)
+        self.m_pgManager1.Bind(wxpg.EVT_PG_PAGE_CHANGED, self.onPGPageChanged)
+        
+        ### Prebuilt pg page of each item type, see __get_pg_page().
+        self.pg_pages = {}
+        self.pg_type = None
+        
+        ### Every handler needs a graph, show an empty one till the template graph is 
+        ### built after the 1st frame. It's made without parsing, the 1st parse builds 
+        ### the pyparsing grammar.
+        self.update_graph( ExtGraph.ExtGraph(obj_dict=pydot.Dot('G').obj_dict, render=False) )
+        self.placeholder_graph = self.data_graph
+        
+        mark_startup('MF.__init__ rest')
         
         return
     
+    def __init_graph(self):
+        '''Replace the empty graph shown at startup by the one of the template, if the
+        user didn't edit or replace it yet. Its parse builds the pyparsing grammar.'''
+        
+        graph = ExtGraph.ExtGraph('G', render=False)
+        if self.data_graph is self.placeholder_graph and not self.is_data_changed:
+            self.update_graph(graph)
+        self.placeholder_graph = None
+    
+    def __build_help_menu(self):
+        '''Build help popmenu from the help files, if not yet.'''
+        if not self.m_menu_help is None:
+            return
+        
+        self.m_menu_help = wx.Menu()
+        
+        help_list = []
+        help_files = os.listdir(resource_path('resource/help/'))
+        for hf in help_files:
+            if hf[0].isdigit() and hf[-3:].lower() == 'dot':
+                help_list.append(hf[:-4])
+        
+        for item in help_list:
+            m_id = wx.NewIdRef()
+            self.m_menu_help.Append(m_id, item)
+            self.m_menu_help.Bind(wx.EVT_MENU, self.onHelpMenu, id=m_id )
+            
+        self.m_menu_help.AppendSeparator()
+        m_id = wx.NewIdRef()
+        self.m_menu_help.Append(m_id, '&About')
+        self.m_menu_help.Bind(wx.EVT_MENU, self.onAbout, id=m_id )
+    
+    def get_image_list(self, key):
+        '''Return the image list of key in IMAGE_LIST_DEFINE, build it at the 1st call.'''
+        
+        il = self.image_list.get(key)
+        if il is None:
+            il = load_image_list(*IMAGE_LIST_DEFINE[key])
+            self.image_list[key] = il
+            
+        return il
+    
+    def onIdleStartup(self, event):
+        '''Run one deferred startup task per idle event, then stop listening.'''
+        
+        if len(STARTUP_TIMES) and STARTUP_TIMES[-1][0] == 'show':
+            mark_startup('first frame')
+        
+        if len(self.startup_tasks):
+            phase, task = self.startup_tasks.pop(0)
+            task()
+            mark_startup(phase)
+            event.RequestMore()
+        else:
+            self.Unbind(wx.EVT_IDLE, handler=self.onIdleStartup)
+            if PROFILE_STARTUP:
+                report_startup()
+            
+        event.Skip()
+    
+    def __tree_children(self, graph):
+        '''List (type, obj_dict) of the items shown under graph in m_tree, in order.'''
+        
+        children = []
+        for k, n_list in graph.obj_dict['nodes'].items():
+            if remove_double_quote(k).lower() in ['node', 'edge']: ### Skip the wildcard node.
+                continue
+            children += [ ('node', obj) for obj in n_list ]
+        
+        for e_list in graph.obj_dict['edges'].values():
+            children += [ ('edge', obj) for obj in e_list ]
+        
+        for sg_list in graph.obj_dict['subgraphs'].values():
+            children += [ ('graph', obj) for obj in sg_list ]
+        
+        return children
+    
     def __spread_tree(self, rootid):
-        '''A  recursive function to add all data from graph into m_tree_ctrl.'''
+        '''Add data from graph into m_tree_ctrl, a page of TREE_PAGE_SIZE items at most.
+        Call it again to add the next page. Subgraphs are spread when expanded.'''
         
         _, graph = self.m_tree.GetItemData(rootid)
         
+        ### Find items already added, and the "more" item of last page.
+        shown = set()
+        more_id = None
+        child, cookie = self.m_tree.GetFirstChild(rootid)
+        while child.IsOk():
+            c_type, c_data = self.m_tree.GetItemData(child)
+            if c_type == 'more':
+                more_id = child
+            elif not c_data is None:
+                shown.add(id(c_data.obj_dict))
+            child, cookie = self.m_tree.GetNextChild(rootid, cookie)
+        
+        if not more_id is None:
+            self.m_tree.Delete(more_id)
+        
         ### Add wildcard nodes.
+        if self.m_tree.GetChildrenCount(rootid, False) == 0:
+            for n in ['node', 'edge']:
+                n_id = self.m_tree.AppendItem(rootid, n)
+                n_data = self.data_graph.EG_get_node_by_name(n, root_graph=graph)
+                self.m_tree.SetItemData(n_id, ('node',  n_data))
+                self.m_tree.SetItemImage(n_id, self.img_dict[(n, 'gray')])
+        
+        children = [ c for c in self.__tree_children(graph) if not id(c[1]) in shown ]
+        
+        for i_type, obj in children[:TREE_PAGE_SIZE]:
+            self.__append_tree_item(rootid, i_type, obj)
+        
+        ### The rest of items is loaded when "more" item selected.
+        if len(children) > TREE_PAGE_SIZE:
+            n_id = self.m_tree.AppendItem(rootid, '... %d more'%(len(children) - TREE_PAGE_SIZE))
+            self.m_tree.SetItemData(n_id, ('more', None))
+        
+        return
+    
+    def __tree_item_label(self, i_type, obj):
+        '''Get the text of m_tree item by type and obj_dict of the item.'''
+        
+        if i_type == 'edge':
+            n1 = remove_double_quote( obj['points'][0] )
+            n2 = remove_double_quote( obj['points'][1] )
+            return "%s -> %s"%(n1,n2)
+        
+        return remove_double_quote( obj['name'] )
+    
+    def __append_tree_item(self, rootid, i_type, obj, prev_id=None):
+        '''Add item of node, edge or subgraph to m_tree, after prev_id if given.'''
+        
+        label = self.__tree_item_label(i_type, obj)
+        if prev_id is None:
+            n_id = self.m_tree.AppendItem(rootid, label)
+        else:
+            n_id = self.m_tree.InsertItem(rootid, prev_id, label)
+        
+        if i_type == 'node':
+            item = pydot.Node(obj_dict=obj)
+        elif i_type == 'edge':
+            item = pydot.Edge(obj_dict=obj)
+        else: ### Subgraph, spread it when expanded.
+            item = pydot.Subgraph(obj_dict=obj)
+            self.m_tree.SetItemHasChildren(n_id, True)
+        
+        self.m_tree.SetItemData(n_id, (i_type, item))
+        self.m_tree.SetItemImage(n_id, self.img_dict[(i_type, 'color')])
+        
+        return n_id
+    
+    def __sync_tree(self, rootid, graph):
+        '''Patch the items under rootid to show graph, instead of building them again.
+        Items are matched by type and name, only inserted, removed or renamed items 
+        change in m_tree, so the selection and expansion of others are kept.'''
+        
+        self.m_tree.SetItemText(rootid, remove_double_quote(graph.get_name()))
+        self.m_tree.GetItemData(rootid)[1].obj_dict = graph.obj_dict
+        
+        if self.m_tree.GetChildrenCount(rootid, False) == 0: ### Not spread yet.
+            return
+        
+        ### Index items in tree by type and name.
+        items = {}
+        more_id = None
+        child, cookie = self.m_tree.GetFirstChild(rootid)
+        while child.IsOk():
+            c_type = self.m_tree.GetItemData(child)[0]
+            if c_type == 'more':
+                more_id = child
+            else:
+                items.setdefault((c_type, self.m_tree.GetItemText(child)), []).append(child)
+            child, cookie = self.m_tree.GetNextChild(rootid, cookie)
+        
+        if not more_id is None:
+            self.m_tree.Delete(more_id)
+        
+        ### Wildcard nodes are always the first items.
+        prev_id = None
         for n in ['node', 'edge']:
-            n_id = self.m_tree.AppendItem(rootid, n)
-            n_data = self.data_graph.EG_get_node_by_name(n, root_graph=graph)
-            self.m_tree.SetItemData(n_id, ('node',  n_data))
-            self.m_tree.SetItemImage(n_id, self.img_dict[(n, 'gray')])
-        
-        ### Load nodes.
-        for n in graph.get_nodes():
-            n_name = remove_double_quote( n.get_name() )
-            if n_name.lower() in ['node', 'edge']: ### Skip the wildcard node.
+            for n_id in items.pop(('node', n), []):
+                n_data = self.data_graph.EG_get_node_by_name(n, root_graph=graph)
+                self.m_tree.SetItemData(n_id, ('node', n_data))
+                prev_id = n_id
+        
+        children = self.__tree_children(graph)
+        shown = 0
+        for i_type, obj in children:
+            ids = items.get((i_type, self.__tree_item_label(i_type, obj)))
+            if ids:
+                ### Same item, just point it to the new data.
+                n_id = ids.pop(0)
+                self.m_tree.GetItemData(n_id)[1].obj_dict = obj
+                if i_type == 'graph':
+                    self.__sync_tree(n_id, self.m_tree.GetItemData(n_id)[1])
+            elif more_id is None:
+                n_id = self.__append_tree_item(rootid, i_type, obj, prev_id)
+            else: ### Left for the "more" item.
                 continue
+            prev_id = n_id
+            shown += 1
+        
+        ### Items not in graph any more.
+        for ids in items.values():
+            for n_id in ids:
+                self.m_tree.Delete(n_id)
+        
+        if len(children) > shown:
+            n_id = self.m_tree.AppendItem(rootid, '... %d more'%(len(children) - shown))
+            self.m_tree.SetItemData(n_id, ('more', None))
+        
+        return
+    
+    def __find_tree_names(self, text):
+        '''Node names or labels match text, for the autocomplete of m_search_tree.'''
+        index = self.data_graph.EG_get_index()
+        names = index.nodes.find(text, SUGGESTION_LIMIT)
+        
+        return names + index.labels.find(text, SUGGESTION_LIMIT - len(names))
+    
+    def __find_tree_child(self, rootid, match):
+        '''Find the child of rootid with item data matching, spread the pages of 
+        rootid in m_tree until found. Return None if not found.'''
+        
+        self.__ensure_tree_spread(rootid)
+        
+        child, cookie = self.m_tree.GetFirstChild(rootid)
+        prev = None
+        while child.IsOk():
+            data = self.m_tree.GetItemData(child)
+            if data[0] == 'more': ### Spread the next page, go on after prev.
+                self.__spread_tree(rootid)
+                if prev is None:
+                    child, cookie = self.m_tree.GetFirstChild(rootid)
+                else:
+                    child = self.m_tree.GetNextSibling(prev)
+                continue
+            if match(child, data):
+                return child
+            prev = child
+            child = self.m_tree.GetNextSibling(child)
+        
+        return None
+    
+    def __find_tree_node(self, name, graph_obj_dict):
+        '''Find the item of node name in graph in m_tree, None if not found.'''
+        
+        path = self.data_graph.EG_find_graph_path(graph_obj_dict)
+        if path is None:
+            return None
+        
+        i_id = self.m_tree.GetRootItem()
+        for od in path[1:]:
+            i_id = self.__find_tree_child(i_id, 
+                        lambda c, data: data[0] == 'graph' and data[1].obj_dict is od)
+            if i_id is None:
+                return None
+        
+        return self.__find_tree_child(i_id, 
+                    lambda c, data: data[0] == 'node' and self.m_tree.GetItemText(c) == name)
+    
+    def onFindInTree(self, event):
+        '''Select the next node whose name or label matches the text of m_search_tree.'''
+        
+        text = self.m_search_tree.GetValue().strip()
+        if text == '':
+            return
+        
+        index = self.data_graph.EG_get_index()
+        
+        ### Every node in every graph holding it.
+        found = []
+        for name in index.find_nodes(text):
+            for g in index.node_graphs.get(name, []):
+                found.append((name, g))
+        if len(found) == 0:
+            wx.Bell()
+            return
+        
+        ### Enter again to go to the next one.
+        last_text, i = self.find_state
+        i = (i + 1)%len(found) if last_text == text else 0
+        self.find_state = (text, i)
+        
+        name, g = found[i]
+        i_id = self.__find_tree_node(name, g)
+        if i_id is None:
+            wx.Bell()
+            return
+        
+        self.m_tree.EnsureVisible(i_id)
+        self.m_tree.SelectItem(i_id)
+        
+        return
+    
+    def __ensure_tree_spread(self, item_id):
+        '''Spread a subgraph item of m_tree if not done yet.'''
+        
+        if self.m_tree.GetItemData(item_id)[0] == 'graph' and \
+           self.m_tree.GetChildrenCount(item_id, False) == 0:
+            self.__spread_tree(item_id)
+        
+        return
+    
+    def __expand_tree(self, rootid):
+        '''Expand subgraph items level by level as ExpandAll does, but stop when 
+        m_tree has TREE_EXPAND_LIMIT items. The others spread when user expands them.'''
+        
+        queue = [rootid]
+        while queue and self.m_tree.GetCount() < TREE_EXPAND_LIMIT:
+            i_id = queue.pop(0)
+            self.__ensure_tree_spread(i_id)
+            self.m_tree.Expand(i_id)
             
-            n_id = self.m_tree.AppendItem(rootid, n_name)
-            self.m_tree.SetItemData(n_id, ('node', n))
-            self.m_tree.SetItemImage(n_id, self.img_dict[('node', 'color')])
-            
+            child, cookie = self.m_tree.GetFirstChild(i_id)
+            while child.IsOk():
+                if self.m_tree.GetItemData(child)[0] == 'graph':
+                    queue.append(child)
+                child, cookie = self.m_tree.GetNextChild(i_id, cookie)
         
-        ### Load edges.
-        for e in graph.get_edges():
-            n1 = remove_double_quote( e.get_source() )
-            n2 = remove_double_quote( e.get_destination() )
-            n_id = self.m_tree.AppendItem(rootid, "%s -> %s"%(n1,n2))
-            self.m_tree.SetItemData(n_id, ('edge', e))
-            self.m_tree.SetItemImage(n_id, self.img_dict[('edge', 'color')])
-        
-        ### Load subgraphs.
-        for sg in graph.get_subgraphs():
-            sg_name = remove_double_quote( sg.get_name() )
-            n_id = self.m_tree.AppendItem(rootid, sg_name)
-            self.m_tree.SetItemData(n_id, ('graph', sg))
-            self.m_tree.SetItemImage(n_id, self.img_dict[('graph', 'color')])
-            self.__spread_tree(n_id)
+        return
+    
+    def onTreeExpanding(self, event):
+        '''Spread the subgraph item before it is expanded.'''
+        
+        self.__ensure_tree_spread(event.GetItem())
         
         return
     
@@ -487,15 +1042,31 @@ class MF(MainFrame):
             
         return result
     
-    def update_graph(self, graph=None):
-        '''Updata data graph and then refresh the whole UI. IF graph == None, just refresh the preview.'''
+    def update_graph(self, graph=None, sync_tree=False):
+        '''Updata data graph and then refresh the whole UI. IF graph == None, just refresh the preview.
+        If sync_tree, only patch the changed items of m_tree instead of building it again.'''
         
-        if not (graph is None):
+        if not (graph is None) and sync_tree and self.m_tree.GetRootItem().IsOk():
             
-            self.data_graph = ExtGraph.ExtGraph(obj_dict=graph.obj_dict)
+            last = self.data_graph.get_bitmap()
+            self.data_graph = ExtGraph.ExtGraph(obj_dict=graph.obj_dict, renderer=self.preview_renderer.submit)
+            self.data_graph.EG_keep_bitmap(last)
+            
+            root = self.m_tree.GetRootItem()
+            self.m_tree.SetItemData(root, ('graph', self.data_graph))
+            self.__sync_tree(root, self.data_graph)
+            
+            ### Items kept their selection, but pg should show the new data.
+            self.onItemSelected(None)
+            
+            self.__apply_focus()
+            self.data_graph.refresh_bitmap()
+        
+        elif not (graph is None):
+            
+            self.data_graph = ExtGraph.ExtGraph(obj_dict=graph.obj_dict, renderer=self.preview_renderer.submit)
             
             self.m_tree.DeleteAllItems()
-            self.m_pgManager1.Clear()
                     
             ### Insert wildcard item at 1st.
             g_name = remove_double_quote(self.data_graph.get_name())
@@ -505,11 +1076,12 @@ class MF(MainFrame):
             
             self.__spread_tree(root)
             
-            self.m_tree.ExpandAll()
+            self.__expand_tree(root)
             self.m_tree.SelectItem(root)
             self.onItemSelected(None)
         
             # Refresh image panel.
+            self.__apply_focus()
             self.data_graph.refresh_bitmap()
         
             # Set zoom ratio.
@@ -544,6 +1116,39 @@ class MF(MainFrame):
                 
         self.SetTitle(title)
         
+        self.__show_render_stats()
+        
+        return
+    
+    def __show_render_stats(self):
+        '''Tell in the status bar how the preview was rendered, and the warnings of graphviz.'''
+        
+        if self.export_queue.get_pending() > 0: ### Export progress is shown there.
+            return
+        
+        stats = self.data_graph.render_stats
+        if not self.data_graph.focus is None:
+            text = 'Focus on "%s", Alt+F to show the whole graph. '%remove_double_quote(self.data_graph.focus['name'])
+        else:
+            text = ''
+        
+        if self.data_graph.draft_shown:
+            text += 'Draft preview shown, rendering the full one...'
+        elif not self.data_graph.render_pending is None:
+            text += 'Rendering preview...'
+        elif not self.data_graph.render_error is None:
+            text += 'Preview failed, the last good one is shown: ' + self.data_graph.render_error.splitlines()[0]
+        elif not self.data_graph.preview_note is None:
+            text += self.data_graph.preview_note
+        elif not stats is None:
+            text += 'Rendered by %s in %.2fs'%(stats['prog'], stats['time'])
+            if not stats['max_rss'] is None:
+                text += ', %.1f MB'%(stats['max_rss']/1024.0)
+            if stats['warnings']:
+                text += '. %d warnings: %s'%(len(stats['warnings']), stats['warnings'][0])
+        
+        self.SetStatusText(text)
+        
         return
 
     def changeZoom(self, zoom_ratio):
@@ -692,6 +1297,8 @@ class MF(MainFrame):
             g.set_type(g_type)
             g.set_name(g_name)
             g.prog = g_prog
+            # Graph type changes the edge operator in all subgraphs.
+            g.EG_mark_dirty(recursive=True)
             
             self.update_graph()
     
@@ -712,6 +1319,9 @@ class MF(MainFrame):
         else:
             root_id = self.m_tree.GetItemParent(i_id)
             root_graph = self.m_tree.GetItemData(root_id)[1]
+        
+        ### Spread it first, or the appended item would be added twice.
+        self.__ensure_tree_spread(root_id)
             
         dlg = DA(self)
         r = dlg.ShowModal()
@@ -786,6 +1396,11 @@ class MF(MainFrame):
             label = escape_dot_string(dlg.m_textCtrl_label.GetValue())
             if label != '':
                 a_data.set('label', add_double_quote(label))
+                if v[0] == 'node':
+                    self.data_graph.EG_index_label(a_data)
+            
+            ### Attrs set after appending, mark the graph changed again.
+            self.data_graph.EG_mark_dirty(root_graph)
             
             ### Select the item in tree.
             if not a_id is None:
@@ -830,6 +1445,8 @@ class MF(MainFrame):
                 root_id = self.m_tree.GetItemParent(i_id)
                 root_graph = self.m_tree.GetItemData(root_id)[1]
 
+            self.__ensure_tree_spread(root_id)
+
             i_name += '_copy'
             if not i_name.startswith('node_'):
                 i_name = 'node_' + i_name
@@ -866,9 +1483,11 @@ class MF(MainFrame):
                     itemattrval = labelprefix + itemattrval.replace('\"','')
                 
                 a_data.set(itemattribute, add_double_quote(itemattrval))
+            self.data_graph.EG_index_label(a_data)
             
             self.m_tree.SetItemData(a_id, ('node', a_data))
             self.m_tree.SetItemImage(a_id, self.img_dict[('node', 'color')])
+            self.data_graph.EG_mark_dirty(root_graph)
 
             ### Select the item in tree.
             if not a_id is None:
@@ -890,7 +1509,7 @@ class MF(MainFrame):
             return
 
         # Warning when delete NOT empty subgraph.
-        if self.m_tree.GetChildrenCount(selected_id) > 0:
+        if self.m_tree.ItemHasChildren(selected_id):
             md = wx.MessageDialog(self, 
                                   "The selected subgraph not EMPTY, to delete it should "+\
                                   "lead to DATA LOST, continue anyway?",
@@ -906,8 +1525,8 @@ class MF(MainFrame):
                 
         
         i_name, i_type, _ = self.GetSelectedItem()
-        ### Skip wildcard.
-        if i_name in ['node', 'edge']:   
+        ### Skip wildcard and "more" item.
+        if i_name in ['node', 'edge'] or i_type == 'more':   
             return
         
         # Get root of selected item.
@@ -924,7 +1543,6 @@ class MF(MainFrame):
             
         ### Delete from listctrl and clear pg panel.
         self.m_tree.Delete(selected_id)
-        self.m_pgManager1.Clear()
         
         ### Fill pg panel.
         self.onItemSelected(None)
@@ -955,6 +1573,12 @@ class MF(MainFrame):
 
         i_name, i_type, item = self.GetSelectedItem()
         
+        # Load next page of items instead of "more" item.
+        if i_type == 'more':
+            self.__clear_pg_pages()
+            wx.CallAfter(self.__spread_tree, self.m_tree.GetItemParent(selected_id))
+            return
+        
         # Change the title of pg.
         _tail = ''
         if i_name in ['node', 'edge']: ### Change the wildcard item's type.
@@ -972,10 +1596,90 @@ class MF(MainFrame):
         if not item is None:
             data_attrs = item.get_attributes()
 
-        ### Build PGManager. 
+        ### Show the prebuilt page of i_type and only patch the attrs changed.
+        page = self.__get_pg_page(i_type)
+        bg_color = self.m_tree.GetBackgroundColour()
+        shown = page['shown']
+        props = page['props']
+        
+        for a_name in list(shown.keys()):
+            if a_name in data_attrs:
+                continue
+            # Restore attr not in new item to default.
+            pg = props[a_name]
+            default = page['defaults'][a_name]
+            if default is None:
+                pg.SetValueToUnspecified()
+            else:
+                pg.SetValue(default)
+            pg.SetBackgroundColour(bg_color, -1)
+            del shown[a_name]
+        
+        for a_name, v in data_attrs.items():
+            if not a_name in props or shown.get(a_name) == v:
+                continue
+            pg = props[a_name]
+            pg.SetValue(remove_double_quote(to_unicode(v)))
+            # Set background to blue if attr value is different from default.
+            pg.SetBackgroundColour('#ffffc0', -1)
+            shown[a_name] = v
+        
+        self.m_pgManager1.Refresh()
+        
+        ### Selected by user, the focused subgraph may change.
+        if not event is None and self.__apply_focus():
+            self.update_graph()
+
+        return
+    
+    def __apply_focus(self):
+        '''Focus the preview on the subgraph of the selected item in focus mode, 
+        on the whole graph otherwise. Return True if the focus changed.'''
+        
+        graph = None
+        root = self.m_tree.GetRootItem()
+        i_id = self.m_tree.GetSelection()
+        if self.focus_mode and i_id.IsOk() and i_id != root:
+            i_type, graph = self.m_tree.GetItemData(i_id)
+            if i_type != 'graph':
+                i_id = self.m_tree.GetItemParent(i_id)
+                graph = self.m_tree.GetItemData(i_id)[1]
+        
+        return self.data_graph.EG_set_focus(graph)
+    
+    def onToggleFocus(self, event):
+        
+        self.focus_mode = not self.focus_mode
+        self.__apply_focus()
+        self.update_graph()
+        
+        return
+    
+    def __clear_pg_pages(self):
+        '''Remove all pg pages, they would be built again when needed.'''
+        self.pg_pages = {}
+        self.pg_type = None
+        self.m_pgManager1.Clear()
+    
+    def __get_pg_page(self, i_type):
+        '''Select the pg page of i_type, build it at the 1st time.
+        
+        Return a dict with the page index, the properties by attr name, their 
+        default values and the attr values currently shown (all raw values).'''
+        
         pm = self.m_pgManager1
-        pm.Clear()
-        pm.AddPage() ### Very important!!! No-page would cause some strange thing happened.
+        page = self.pg_pages.get(i_type)
+        if not page is None:
+            self.pg_type = i_type
+            pm.SelectPage(page['index'])
+            return page
+        
+        ### Build PGManager. 
+        pm.AddPage(i_type.capitalize()) ### Very important!!! No-page would cause some strange thing happened.
+        page = {'index':pm.GetPageCount()-1, 'props':{}, 'defaults':{}, 'shown':{}}
+        self.pg_pages[i_type] = page
+        self.pg_type = i_type
+        pm.SelectPage(page['index'])
         
         # Get attrs structure of the graph item.
         cates, _, attrs_dict = AttrsDef.get_dot_attr_structure(i_type)
@@ -1002,13 +1706,12 @@ class MF(MainFrame):
                         pm.Append(pg)
                     else:
                         pm.AppendIn(g_id, pg)
-
-                    # Set attr value read from data_graph.
-                    if a_name in data_attrs.keys():
-                        v = data_attrs[a_name]
-                        pg.SetValue(remove_double_quote(to_unicode(v)))
-                        # Set background to blue if attr value is different from default.
-                        pg.SetBackgroundColour('#ffffc0', -1)
+                    
+                    page['props'][a_name] = pg
+                    if pg.IsValueUnspecified():
+                        page['defaults'][a_name] = None
+                    else:
+                        page['defaults'][a_name] = pg.GetValue()
                 
                 if not  _g is None:
                     pm.Collapse(_g)
@@ -1017,7 +1720,14 @@ class MF(MainFrame):
             if cates.index(_c):
                 pm.Collapse(_c)
 
-        return
+        return page
+    
+    def onPGPageChanged(self, event):
+        '''Pages are switched by item selection only, keep the page of selected item.'''
+        
+        page = self.pg_pages.get(self.pg_type)
+        if not page is None and self.m_pgManager1.GetSelectedPage() != page['index']:
+            self.m_pgManager1.SelectPage(page['index'])
     
     def onPGActive(self, event):
 
@@ -1029,7 +1739,7 @@ class MF(MainFrame):
     
     def onPGChanged(self, event):
         
-        _, _, item = self.GetSelectedItem()
+        _, i_type, item = self.GetSelectedItem()
         
         if item is None:
             raise Exception("Sth strange happend! Can't find item to store attrs.")
@@ -1053,6 +1763,7 @@ class MF(MainFrame):
             v = str(v)
         
         ### Update attr.
+        old_value = item.get_attributes().get(key)
         uv = to_unicode(v); udv = to_unicode(str(p.GetDefaultValue()))
         if uv == '' or uv.lower() == udv.lower():
             try:
@@ -1064,6 +1775,27 @@ class MF(MainFrame):
             v = p.GetDefaultValue()
         else:
             item.get_attributes()[key] = add_double_quote(v)
+        
+        if key == 'label' and i_type == 'node':
+            self.data_graph.EG_index_label(item)
+        
+        ### Keep the shown values of the cached pg page in step.
+        page = self.pg_pages.get(self.pg_type)
+        if not page is None:
+            attrs = item.get_attributes()
+            if key in attrs:
+                page['shown'][key] = attrs[key]
+            else:
+                page['shown'].pop(key, None)
+        
+        ### Mark the graph holding the item as changed.
+        if i_type == 'graph':
+            root_graph = item
+        else:
+            r_id = self.m_tree.GetItemParent(self.m_tree.GetSelection())
+            root_graph = self.m_tree.GetItemData(r_id)[1]
+        self.data_graph.EG_mark_dirty(root_graph)
+        self.data_graph.EG_record_attr(item, key, old_value, root_graph=root_graph)
                 
         ### Change PG background if value is different from default.
         if uv == udv:
@@ -1077,6 +1809,31 @@ class MF(MainFrame):
         
         return
                     
+    def onUndo(self, event):
+        
+        if self.data_graph.undo_change():
+            self.__history_changed()
+        
+        return
+    
+    def onRedo(self, event):
+        
+        if self.data_graph.redo_change():
+            self.__history_changed()
+        
+        return
+    
+    def __history_changed(self):
+        '''Show the graph after undo or redo, update_graph() refreshes the bitmap.'''
+        
+        self.__sync_tree(self.m_tree.GetRootItem(), self.data_graph)
+        self.onItemSelected(None)
+        
+        self.is_data_changed = True
+        self.update_graph()
+        
+        return
+                    
     def onNewGraph(self, event):
         
         if self.is_data_changed:
@@ -1091,7 +1848,7 @@ class MF(MainFrame):
 
         self.file_path = None        
         self.is_data_changed = False
-        self.update_graph( ExtGraph.ExtGraph('G') )
+        self.update_graph( ExtGraph.ExtGraph('G', render=False) )
             
         return
     
@@ -1155,16 +1912,8 @@ class MF(MainFrame):
         else:
             fp = self.file_path
         
-        ### Backup old file.
-        if os.path.isfile(fp):
-            pn, fn = os.path.split(fp)
-            new_fp = os.path.join(pn, time.strftime('backup_%y%m%d%H%M%S') + '_' + fn)
-            shutil.copy(fp, new_fp)
-        ### Save graph now.
-        
-        f = open(fp, 'wb')
-        f.write(self.data_graph.EG_to_string())
-        #self.data_graph.write(fp)
+        ### Save graph now, the old file is kept in the backups.
+        atomic_save(fp, self.data_graph.EG_write)
         
         self.file_path = fp
         self.is_data_changed = False
@@ -1190,14 +1939,9 @@ class MF(MainFrame):
             if md.ShowModal() != wx.ID_YES:
                 return 
                 
-        ### Backup old file.
-        if os.path.isfile(fp):
-            pn, fn = os.path.split(fp)
-            new_fp = os.path.join(pn, time.strftime('backup_%y%m%d%H%M%S') + '_' + fn)
-            shutil.copy(fp, new_fp)
                     
-        ### Save graph now.
-        self.data_graph.write(fp)
+        ### Save graph now, the old file is kept in the backups.
+        atomic_save(fp, self.data_graph.EG_write)
         self.file_path = fp
         self.is_data_changed = False
         self.update_graph()
@@ -1216,17 +1960,75 @@ class MF(MainFrame):
         else:
             return  ### User canceled.
         
-        g_format = fp.split('.')[-1]
-        self.data_graph.write(fp, self.data_graph.prog, g_format.lower())
+        if fd.GetFilterIndex() == G_FORMAT_WILDCARD.count('|')//2:
+            base = os.path.splitext(fp)[0]
+            paths = [ base+'.'+f for f in G_FORMAT_BATCH ]
+        else:
+            paths = [fp]
         
         fd.Destroy()
+        
+        ### Rendered in background, the script is taken now so later edits don't matter. 
+        ### The layout of the preview is output as it is, if it's of the same script.
+        layout = self.data_graph.EG_get_layout()
+        if layout is None:
+            script = self.data_graph.to_string()
+        else:
+            script = None
+        self.export_queue.put(script, self.data_graph.prog, paths, layout, self.data_graph.shape_files)
+        self.SetStatusText('Exporting %s... (Esc to cancel)'%', '.join(map(os.path.basename, paths)))
+        
+        return
+    
+    def onExportProgress(self, job, done, total, error):
+        
+        names = ', '.join(map(os.path.basename, job['paths']))
+        if not error is None:
+            self.SetStatusText('Export of %s failed: %s'%(names, error.splitlines()[0]))
+        elif done < total:
+            self.SetStatusText('Exporting %s... %d/%d (Esc to cancel)'%(names, done, total))
+        else:
+            self.SetStatusText('Exported %s'%names)
+        
+        return
+    
+    def onPreviewRendered(self, job, data, stats, error, draft=False, layout=None):
+        
+        graph = job['graph']
+        if draft:
+            graph.EG_set_draft(job['key'], data, stats)
+        elif error is None:
+            graph.EG_set_rendered(job['key'], job['prog'], data, stats, job['counts'], layout)
+        else:
+            graph.EG_render_failed(job['key'], error)
+        
+        if graph is self.data_graph:
+            self.update_graph()
+        
+        return
+    
+    def onPerfReadout(self, event):
+        
+        self.SetStatusText(DEUtils.perf_summary(), 1)
+        
+        return
+    
+    def onCancelExport(self, event):
+        
+        if event.GetKeyCode() == wx.WXK_ESCAPE and self.export_queue.get_pending() > 0:
+            self.export_queue.cancel()
+            self.SetStatusText('Cancelling export...')
+        else:
+            event.Skip()
+        
+        return
 
     
     def onViewSource(self, event):
         dlg = DS(self)
         dlg.SetScript(self.data_graph.EG_to_string())
         if dlg.ShowModal() == wx.ID_OK:
-            self.update_graph(dlg.graph)
+            self.update_graph(dlg.graph, sync_tree=True)
             self.is_data_changed = True
         dlg.Destroy()
         
@@ -1250,6 +2052,7 @@ class MF(MainFrame):
         
         y += h
         
+        self.__build_help_menu()
         self.PopupMenu( self.m_menu_help, x, y)
         
     def onAbout(self, event):
@@ -1268,6 +2071,17 @@ class MF(MainFrame):
                                    )
             if md.ShowModal() != wx.ID_YES:
                 return
+        
+        if self.export_queue.get_pending() > 0:
+            md = wx.MessageDialog(self, 
+                                  "Images are being exported, close the window "+\
+                                   "should cancel them, continue anyway?",
+                                   caption="Confirm to close",
+                                   style=wx.YES_NO|wx.NO_DEFAULT|wx.ICON_EXCLAMATION
+                                   )
+            if md.ShowModal() != wx.ID_YES:
+                return
+            self.export_queue.cancel()
                     
         wx.Exit()
 
@@ -1283,6 +2097,7 @@ if __name__ == "__main__":
     
     #app = wx.App(redirect=True, filename="./log.txt")
     app = wx.App()
+    mark_startup('wx.App')
     
     if not __check_graphviz():
         wx.MessageBox('Please confirm graphviz installed correct in the computer, '+\
@@ -1290,8 +2105,16 @@ if __name__ == "__main__":
                       'For more infomation about graphviz please visit: http://www.graphviz.org', 
                       "Can't find graphviz", wx.ICON_ERROR)
         app.Exit()
+    mark_startup('graphviz check')
         
+    if PROFILE_PERF:
+        enable_perf()
+    
     frame = MF(parent=None)
     frame.Show(True)
+    mark_startup('show')
     app.MainLoop()
+    
+    if PROFILE_PERF:
+        print(DEUtils.perf_report())
     
\ No newline at end of file
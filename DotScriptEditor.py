@@ -188,7 +188,7 @@ class DS(DialogScript):
             g = ExtParser.parse_string(script)
             ### Hack the strcit status cause bug of pydot.
             g.set_strict(strict_status)
-            g = ExtGraph.ExtGraph(obj_dict=g.obj_dict)
+            g = ExtGraph.ExtGraph(obj_dict=g.obj_dict, render=False)
 
         except ExtParser.ParseException as err:
             
@@ -222,7 +222,8 @@ class DS(DialogScript):
             ### Hack the strcit status cause bug of pydot.
             g.set_strict(strict_status)
             
-            self.graph = ExtGraph.ExtGraph(obj_dict=g.obj_dict)
+            ### Rendered by the preview renderer of the main window.
+            self.graph = ExtGraph.ExtGraph(obj_dict=g.obj_dict, render=False)
             self.EndModal(wx.ID_OK)
 
         except ExtParser.ParseException as err:
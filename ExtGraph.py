@@ -11,15 +11,74 @@ The core class base on the PyDot project. (https://github.com/erocarrera/pydot)
 '''
 
 import pydot
-import wx, sys
+import sys
+try:
+    import wx
+except ImportError: ### Headless, e.g. batch.py, graphs have no preview then.
+    wx = None
 import ExtParser
 from DEUtils import to_unicode, add_double_quote,\
     remove_double_quote
-import tempfile
 import DEUtils
+import tempfile, shutil
+import bisect, heapq, hashlib, io
+from collections import OrderedDict
 
 
-TEMP_IMG_FILE = tempfile.gettempdir()+'/de_tempimg.png'
+### Changes kept for undo_change(), the oldest ones are dropped beyond it.
+UNDO_LIMIT = 100
+### Rendered png kept by script, so going back to a script shown before never runs graphviz.
+RENDER_CACHE_SIZE = 8
+### Seconds a preview render may take before graphviz is killed, None for no limit.
+RENDER_TIMEOUT = 120
+
+### Layout seconds by engine are estimated as scale*(nodes+edges)**power, 
+### engine: (scale, power), see estimate_layout_cost().
+LAYOUT_COST_MODEL = {'dot':   (1e-5, 1.5),
+                     'neato': (3e-7, 2.0),
+                     'fdp':   (3e-7, 2.0),
+                     'circo': (3e-7, 2.0),
+                     'twopi': (1e-5, 1.2),
+                     'sfdp':  (3e-5, 1.1),
+                     }
+### Measured/estimated time of the renders done, by engine, to fit the model to this machine.
+LAYOUT_COST_FIT = {}
+### Previews estimated to take longer than it (seconds) are rendered the fast way, see 
+### ExtGraph.get_preview_prog(). None to always render them as they are.
+PREVIEW_COST_LIMIT = 10
+### The fast way of dot: less iterations of ranking and crossing minimization, straight edges.
+DOT_FAST_ARGS = ['-Gnslimit=2', '-Gnslimit1=2', '-Gmclimit=0.1', '-Gsplines=line']
+### Previews estimated over it (seconds) are shown first as a draft rendered the fast 
+### way of the engine by DRAFT_ARGS, then the full one. None for no draft.
+DRAFT_COST_LIMIT = 1
+### Attrs of the nodes outside the focused subgraph that its boundary edges go to.
+FOCUS_STUB_ATTRS = '[style=dashed, color=gray, fontcolor=gray]'
+DRAFT_ARGS = {'dot':   DOT_FAST_ARGS,
+              'neato': ['-Gmaxiter=100', '-Gsplines=false'],
+              'fdp':   ['-Gmaxiter=100', '-Gsplines=false'],
+              'sfdp':  ['-Gsplines=false'],
+              'circo': ['-Gsplines=false'],
+              'twopi': ['-Gsplines=false'],
+              }
+
+def estimate_layout_cost(prog, nodes, edges):
+    '''Estimate the seconds for prog to lay out a graph of nodes and edges.'''
+    
+    scale, power = LAYOUT_COST_MODEL.get(prog, LAYOUT_COST_MODEL['dot'])
+    
+    return LAYOUT_COST_FIT.get(prog, 1.0) * scale * (nodes+edges)**power
+
+def fit_layout_cost(prog, nodes, edges, seconds):
+    '''Fit the estimate of prog to a render of seconds measured.'''
+    
+    est = estimate_layout_cost(prog, nodes, edges)
+    if est < 0.1: ### Mostly the start of the process, tells nothing.
+        return
+    
+    ratio = seconds / est * LAYOUT_COST_FIT.get(prog, 1.0)
+    LAYOUT_COST_FIT[prog] = 0.7*LAYOUT_COST_FIT.get(prog, ratio) + 0.3*ratio
+    
+    return
 
 TEMPLATE_DOT = DEUtils.resource_path('GraphTemplate.dot')
 INIT_SCRIPT = '''
@@ -37,15 +96,325 @@ graph G {
 }
 '''
 
+class NameIndex(object):
+    '''Names kept sorted with a reference count each, to look up by prefix or 
+    substring without walking the graph. Lookups ignore the case.'''
+    
+    def __init__(self):
+        self.__names = []   ### Sorted names.
+        self.__keys = []    ### Sorted (lower case name, name).
+        self.__counts = {}
+    
+    def add(self, name):
+        c = self.__counts.get(name, 0)
+        if c == 0:
+            bisect.insort(self.__names, name)
+            bisect.insort(self.__keys, (name.lower(), name))
+        self.__counts[name] = c + 1
+    
+    def add_many(self, names):
+        '''add() each of names, the new ones are sorted in at once. insort one by one
+        is quadratic, too slow for the 1st build of a big index.'''
+        new = []
+        for name in names:
+            c = self.__counts.get(name, 0)
+            if c == 0:
+                new.append(name)
+            self.__counts[name] = c + 1
+        
+        if new:
+            self.__names.extend(new)
+            self.__names.sort()
+            self.__keys.extend([ (n.lower(), n) for n in new ])
+            self.__keys.sort()
+    
+    def remove(self, name):
+        c = self.__counts.get(name, 0)
+        if c == 0:
+            return
+        if c > 1:
+            self.__counts[name] = c - 1
+            return
+        
+        del self.__counts[name]
+        del self.__names[bisect.bisect_left(self.__names, name)]
+        del self.__keys[bisect.bisect_left(self.__keys, (name.lower(), name))]
+    
+    def __contains__(self, name):
+        return name in self.__counts
+    
+    def __len__(self):
+        return len(self.__names)
+    
+    def __iter__(self):
+        return iter(list(self.__names))
+    
+    def find(self, text, limit=None):
+        '''Names starting with text first, then the other names containing it.'''
+        key = text.strip().lower()
+        keys = self.__keys
+        
+        result = []
+        i = bisect.bisect_left(keys, (key,))
+        while i < len(keys) and keys[i][0].startswith(key):
+            if not limit is None and len(result) >= limit:
+                return result
+            result.append(keys[i][1])
+            i += 1
+        
+        if key == '':
+            return result
+        
+        for k, name in keys:
+            if not limit is None and len(result) >= limit:
+                break
+            if key in k and not k.startswith(key):
+                result.append(name)
+        
+        return result
+
+def merge_names(*name_lists):
+    '''Merge sorted name lists into one sorted list without duplicates.'''
+    result = []
+    for n in heapq.merge(*name_lists):
+        if not result or result[-1] != n:
+            result.append(n)
+    
+    return result
+
+def remove_port(point):
+    '''Node name of an edge end point, without its port(and compass) and quotes.'''
+    point = point.strip()
+    if point[:1] == '"': ### The port begins after the closing quote.
+        end = 1
+        while end < len(point) and point[end] != '"':
+            end += 2 if point[end] == '\\' else 1
+        return remove_double_quote(point[:end+1])
+    
+    return point.split(':')[0]
+
+class GraphIndex(object):
+    '''Index names of a graph: nodes with their labels and graphs, edge endpoints and targets.'''
+    
+    def __init__(self):
+        self.nodes = NameIndex()
+        self.endpoints = NameIndex()
+        self.labels = NameIndex()
+        self.node_graphs = {}   ### node name -> list of graph obj_dicts having it.
+        self.node_labels = {}   ### node name -> label.
+        self.label_nodes = {}   ### label -> list of node names.
+        self.targets = {}       ### source name -> {destination name: count}.
+    
+    def add_node(self, name, graph_obj_dict, label=None):
+        self.nodes.add(name)
+        self.node_graphs.setdefault(name, []).append(graph_obj_dict)
+        self.set_label(name, label)
+    
+    def add_nodes(self, nodes):
+        '''add_node() each (name, graph_obj_dict, label) of nodes, sorting the names 
+        and labels in at once, see NameIndex.add_many().'''
+        labels = {}
+        for name, graph_obj_dict, label in nodes:
+            self.node_graphs.setdefault(name, []).append(graph_obj_dict)
+            labels[name] = label ### The last one counts, as by add_node().
+        self.nodes.add_many([ n[0] for n in nodes ])
+        
+        new_labels = []
+        for name, label in labels.items():
+            if name in self.node_labels:
+                self.set_label(name, label)
+            elif not label is None:
+                self.node_labels[name] = label
+                self.label_nodes.setdefault(label, []).append(name)
+                new_labels.append(label)
+        self.labels.add_many(new_labels)
+    
+    def remove_node(self, name, graph_obj_dict):
+        graphs = self.node_graphs.get(name, [])
+        for i in range(len(graphs)):
+            if graphs[i] is graph_obj_dict:
+                del graphs[i]
+                self.nodes.remove(name)
+                break
+        if len(graphs) == 0:
+            self.node_graphs.pop(name, None)
+            self.set_label(name, None)
+    
+    def set_label(self, name, label):
+        old = self.node_labels.pop(name, None)
+        if not old is None:
+            self.labels.remove(old)
+            self.label_nodes[old].remove(name)
+            if len(self.label_nodes[old]) == 0:
+                del self.label_nodes[old]
+        
+        if not label is None:
+            self.node_labels[name] = label
+            self.labels.add(label)
+            self.label_nodes.setdefault(label, []).append(name)
+    
+    def add_edge(self, src, dst):
+        self.endpoints.add(src); self.endpoints.add(dst)
+        t = self.targets.setdefault(src, {})
+        t[dst] = t.get(dst, 0) + 1
+    
+    def add_edges(self, edges):
+        '''add_edge() each (src, dst) of edges, sorting the names in at once.'''
+        points = []
+        for src, dst in edges:
+            points.append(src); points.append(dst)
+            t = self.targets.setdefault(src, {})
+            t[dst] = t.get(dst, 0) + 1
+        self.endpoints.add_many(points)
+    
+    def remove_edge(self, src, dst):
+        t = self.targets.get(src, {})
+        if not dst in t:
+            return
+        self.endpoints.remove(src); self.endpoints.remove(dst)
+        t[dst] -= 1
+        if t[dst] == 0:
+            del t[dst]
+        if len(t) == 0:
+            del self.targets[src]
+    
+    def get_all_node_names(self):
+        '''All node names, include the end nodes of edges, sorted.'''
+        return merge_names(self.nodes, self.endpoints)
+    
+    def find_names(self, text, limit=None):
+        '''Node names, include the end nodes of edges, match text.'''
+        result = []
+        for n in self.nodes.find(text, limit) + self.endpoints.find(text, limit):
+            if not n in result:
+                result.append(n)
+        
+        return result[:limit]
+    
+    def find_nodes(self, text, limit=None):
+        '''Node names match text by name or by label.'''
+        result = self.nodes.find(text, limit)
+        found = set(result)
+        for l in self.labels.find(text, limit):
+            for n in self.label_nodes[l]:
+                if not n in found:
+                    found.add(n)
+                    result.append(n)
+        
+        return result[:limit]
+
+def render_script(script, prog, format, args=None, timeout=None, cancel=None, shape_files=()):
+    '''Run graphviz prog on the dot script, return its output in format. script 
+    may also be a list of its fragments, streamed into graphviz one by one. It's 
+    killed after timeout seconds or once cancel(threading.Event) is set. 
+    shape_files are the images used by the script, see pydot.Dot.set_shape_files().'''
+    
+    return render_script_stats(script, prog, format, args, timeout, cancel, shape_files)[0]
+
+def render_script_stats(script, prog, format, args=None, timeout=None, cancel=None, shape_files=()):
+    '''Same as render_script(), return the output and the stats of graphviz 
+    as pydot.Dot.create() keeps them.'''
+    
+    if args is None:
+        args = []
+    if isinstance(script, str):
+        script = [script]
+    
+    ### As pydot.Dot.create(), graphviz finds the shape files in its working dir. 
+    ### That's a dir of this run alone, the preview and exports run at once.
+    working_dir = tempfile.gettempdir()
+    if shape_files:
+        working_dir = tempfile.mkdtemp(prefix='de_shapes_')
+        for img in shape_files:
+            shutil.copy(img, working_dir)
+    
+    try:
+        stdout_data, stderr_data, process = pydot.call_graphviz(
+            program=prog, arguments=['-T%s'%format] + args, 
+            working_dir=working_dir, input_fragments=script,
+            timeout=timeout, cancel=cancel)
+    finally:
+        if shape_files:
+            shutil.rmtree(working_dir, ignore_errors=True)
+    
+    if process.returncode != 0:
+        raise Exception('"%s" failed to output %s, returned code %d:\n%s'%(
+            prog, format, process.returncode, to_unicode(stderr_data)))
+    
+    stats = {'prog':prog, 'format':format, 'time':process.wall_time, 'max_rss':process.max_rss, 
+             'warnings':[ l for l in to_unicode(stderr_data).splitlines() if l.strip() ]}
+    
+    return stdout_data, stats
+
+def layout_script(script, prog, cancel=None, shape_files=()):
+    '''Lay out the dot script by prog, return the result in xdot. It holds the 
+    positions of everything, see render_layout().'''
+    
+    return render_script(script, prog, 'xdot', cancel=cancel, shape_files=shape_files).decode('utf-8')
+
+def render_layout(layout, format, cancel=None, shape_files=()):
+    '''Output a layout from layout_script() in format, without laying it out again.'''
+    
+    return render_script(layout, 'neato', format, ['-n2'], cancel=cancel, shape_files=shape_files)
+
+def render_preview(script, prog, timeout=None, cancel=None, shape_files=()):
+    '''Lay the script out by prog(with args) and output the png from that layout, 
+    as layout_script() and render_layout() do. Return the png data, the layout and 
+    the stats of both runs, where 'layout_time' is the time of the layout alone.'''
+    
+    layout, stats = render_script_stats(script, prog[0], 'xdot', prog[1:], timeout, cancel, shape_files)
+    layout = layout.decode('utf-8')
+    data, png_stats = render_script_stats(layout, 'neato', 'png', ['-n2'], timeout, cancel, shape_files)
+    
+    stats['format'] = 'png'
+    stats['layout_time'] = stats['time']
+    stats['time'] += png_stats['time']
+    if not png_stats['max_rss'] is None:
+        stats['max_rss'] = max(stats['max_rss'] or 0, png_stats['max_rss'])
+    stats['warnings'] += png_stats['warnings']
+    
+    return data, layout, stats
+
 class ExtGraph(pydot.Dot):
     
     __bitmap = None
-    __historys = []
-    __history_point = -1
     
-    def __init__(self, graph_name='G', obj_dict=None, template_file=None):
+    def __init__(self, graph_name='G', obj_dict=None, template_file=None, renderer=None, render=True):
+        '''If renderer is given, previews are rendered in background by 
+        renderer(graph, key, prog, script, counts, draft_prog), which may show a 
+        draft by EG_set_draft() first and hands the result to EG_set_rendered() or 
+        EG_render_failed(). The last good bitmap is kept till then. If not render, 
+        the graph is not rendered on creation, only by refresh_bitmap() or the 1st
+        get_bitmap().'''
         pydot.Dot.__init__(self, graph_name=graph_name, obj_dict=obj_dict)
         
+        self.renderer = renderer
+        ### Key of the preview being rendered by renderer, and the error of the last one.
+        self.render_pending = None
+        self.render_error = None
+        ### If the bitmap is the draft of the one pending.
+        self.draft_shown = False
+        ### obj_dict of the subgraph the preview shows alone, None for all, see EG_set_focus().
+        self.focus = None
+        self.__render_failed = None
+        
+        ### Names index, built at the 1st use, see EG_get_index().
+        self.__index = None
+        
+        ### Logs of changes as (label, ops), see __apply_op() for the ops.
+        self.__undo_log = []
+        self.__redo_log = []
+        
+        ### {script hash: (png data, graphviz stats)}, least recently used first.
+        self.__render_cache = OrderedDict()
+        ### (script hash, xdot) of the last preview rendered, see EG_get_layout().
+        self.__layout = None
+        
+        ### Stats of the render of the bitmap, see pydot.Dot.create().
+        self.render_stats = None
+        ### Why the bitmap isn't rendered by prog as it is, None if it is.
+        self.preview_note = None
+        
         # If create empty new graph...
         if (obj_dict is None):
 
@@ -69,7 +438,11 @@ class ExtGraph(pydot.Dot):
         self.set_parent_graph(self)
         ### -------------------------------------------------------------
         
-        self.refresh_bitmap()
+        ### Cache the script of every graph and subgraph from now on.
+        self.EG_mark_dirty(recursive=True)
+        
+        if render:
+            self.refresh_bitmap()
         
         return
     
@@ -84,12 +457,17 @@ class ExtGraph(pydot.Dot):
                 n = pydot.Node(n_name)
                 n.set_comment('Wildcard node added automatic in EG.')
                 root_graph.add_node(n)
+                self.EG_mark_dirty(root_graph)
                 
             ### Anyway, push the wildcard node to the front of all other nodes.
             if n_name == 'node':
-                root_graph.obj_dict['nodes']['node'][0]['sequence'] = 0.5
+                seq = 0.5
             else:
-                root_graph.obj_dict['nodes']['edge'][0]['sequence'] = 0
+                seq = 0
+            wildcard = root_graph.obj_dict['nodes'][n_name][0]
+            if wildcard['sequence'] != seq:
+                root_graph.set_child_sequence(wildcard, seq)
+                self.EG_mark_dirty(root_graph)
             ### -------------------------------------------------------------
         
         sgs  = root_graph.get_subgraphs()
@@ -98,12 +476,60 @@ class ExtGraph(pydot.Dot):
         
         return
     
+    def __find_graph_path(self, graph_obj_dict, root_obj_dict=None):
+        '''Find obj_dicts of the graphs from self down to the graph of graph_obj_dict.
+        Return None if not found. Only subgraphs are walked, never nodes and edges.'''
+        if root_obj_dict is None:
+            root_obj_dict = self.obj_dict
+        
+        if root_obj_dict is graph_obj_dict:
+            return [root_obj_dict]
+        
+        for sg_list in root_obj_dict['subgraphs'].values():
+            for sg in sg_list:
+                path = self.__find_graph_path(graph_obj_dict, sg)
+                if path is not None:
+                    return [root_obj_dict] + path
+        
+        return None
+    
+    def EG_mark_dirty(self, root_graph=None, recursive=False):
+        '''Mark root_graph and all graphs containing it as changed, so their cached 
+        script is built again on the next serialization. If recursive, all subgraphs 
+        inside root_graph are marked too.'''
+        if root_graph is None:
+            root_graph = self
+        
+        self.__mark_dirty(root_graph.obj_dict, recursive)
+        
+        return
+    
+    def __mark_dirty(self, graph_obj_dict, recursive=False):
+        
+        path = self.__find_graph_path(graph_obj_dict)
+        if path is None: ### Not in this graph, anyway mark itself.
+            path = [graph_obj_dict]
+        
+        for g in path:
+            g['dirty'] = True
+        
+        if recursive:
+            graphs = [graph_obj_dict]
+            while graphs:
+                g = graphs.pop()
+                g['dirty'] = True
+                for sg_list in g['subgraphs'].values():
+                    graphs.extend(sg_list)
+        
+        return
+    
     def create_empty_subgraph(self, name):
         sg = pydot.Subgraph()
         sg.set_name(name)
         
         g = ExtParser.parse_string(INIT_SCRIPT_SUBGRAPH)
         sg.obj_dict['nodes'] = g.obj_dict['nodes']
+        sg.invalidate_sequence_index()
         
         return sg
     
@@ -116,11 +542,360 @@ class ExtGraph(pydot.Dot):
         return self.__bitmap
     
     def refresh_bitmap(self):
+        '''Render the graph, reuse the png of the same script rendered lately.
+        The script is never joined, its fragments(shared with the string cache 
+        of the graph) are hashed and streamed into graphviz one by one.'''
+        
+        if wx is None:
+            return
+        
+        script = None
+        if not self.focus is None:
+            script = self.EG_focus_fragments(self.focus)
+            if script is None: ### Not in the graph any more.
+                self.focus = None
+        
+        if self.focus is None:
+            nodes, edges = self.EG_count_items()
+            script = list(self.iter_string())
+        else:
+            nodes, edges = self.EG_count_items(pydot.Subgraph(obj_dict=self.focus))
+        prog, self.preview_note = self.get_preview_prog(nodes, edges)
+        
+        key = self.__script_key(prog, script)
+        
+        cached = self.__render_cache.get(key)
+        if cached is None and not self.renderer is None:
+            if not key in [self.render_pending, self.__render_failed]:
+                self.render_pending = key
+                self.renderer(self, key, prog, script, (nodes, edges), 
+                              self.get_draft_prog(prog, nodes, edges))
+            if self.__bitmap is None: ### Nothing rendered yet.
+                self.__bitmap = wx.Bitmap(1, 1)
+            return
+        
+        if cached is None:
+            data, layout, stats = render_preview(script, prog, RENDER_TIMEOUT, shape_files=self.shape_files)
+            self.EG_set_rendered(key, prog, data, stats, (nodes, edges), layout)
+        else:
+            self.__render_cache.move_to_end(key)
+            self.__set_bitmap(*cached)
 
-        self.write(TEMP_IMG_FILE, self.prog, 'png')
-        self.__bitmap = wx.Bitmap(0,0)
-        self.__bitmap.LoadFile(TEMP_IMG_FILE, wx.BITMAP_TYPE_PNG)
-
+        return
+    
+    def __script_key(self, prog, fragments):
+        '''Hash of the script fragments rendered by prog(with args).'''
+        
+        sha = hashlib.sha1((str(prog) + '\n').encode('utf-8'))
+        for s in fragments:
+            sha.update(s.encode('utf-8'))
+        
+        return sha.hexdigest()
+    
+    def EG_set_rendered(self, key, prog, data, stats, counts, layout=None):
+        '''Take the png data rendered for key by prog(with args), by refresh_bitmap() 
+        or its renderer. counts are the nodes and edges of the graph rendered, layout 
+        the xdot the png was output from, see render_preview().'''
+        
+        self.__render_cache[key] = (data, stats)
+        while len(self.__render_cache) > RENDER_CACHE_SIZE:
+            self.__render_cache.popitem(last=False)
+        if not layout is None:
+            self.__layout = (key, layout)
+        
+        if len(prog) == 1: ### Not the fast way, see get_preview_prog().
+            fit_layout_cost(prog[0], counts[0], counts[1], stats.get('layout_time', stats['time']))
+        
+        if self.render_pending == key:
+            self.render_pending = None
+        self.render_error = None
+        self.__render_failed = None
+        self.draft_shown = False
+        
+        self.__set_bitmap(data, stats)
+        
+        return
+    
+    def EG_get_layout(self):
+        '''Return the xdot layout of the whole graph by self.prog, if the last preview
+        was laid out so from the current script, None otherwise. Exports take it to 
+        skip the layout, see render_layout().'''
+        
+        if self.__layout is None:
+            return None
+        
+        if self.__layout[0] != self.__script_key([self.prog], self.iter_string()):
+            return None
+        
+        return self.__layout[1]
+    
+    def EG_set_draft(self, key, data, stats):
+        '''Show the draft of key by its renderer, if key is still pending.'''
+        
+        if self.render_pending != key:
+            return
+        
+        self.draft_shown = True
+        self.__set_bitmap(data, stats)
+        
+        return
+    
+    def EG_render_failed(self, key, error):
+        '''The renderer failed to render key, keep the last good bitmap and don't 
+        try key again.'''
+        
+        if self.render_pending == key:
+            self.render_pending = None
+        self.render_error = error
+        self.__render_failed = key
+        self.draft_shown = False
+        
+        return
+    
+    def EG_keep_bitmap(self, bitmap):
+        '''Show bitmap, e.g. the one of the graph this replaces, till the pending
+        render is done.'''
+        
+        if not self.render_pending is None:
+            self.__bitmap = bitmap
+        
+        return
+    
+    def __set_bitmap(self, data, stats):
+        self.render_stats = stats
+        self.__bitmap = wx.Bitmap(wx.Image(io.BytesIO(data), wx.BITMAP_TYPE_PNG))
+    
+    def get_preview_prog(self, nodes, edges):
+        '''Return the program (with args) to render the preview and a note why it 
+        isn't self.prog, None if it is. Graphs estimated over PREVIEW_COST_LIMIT are 
+        rendered the fast way of dot, or by sfdp for other engines.'''
+        
+        prog = self.prog
+        est = estimate_layout_cost(prog, nodes, edges)
+        if PREVIEW_COST_LIMIT is None or est <= PREVIEW_COST_LIMIT:
+            return [prog], None
+        
+        reason = '"%s" is estimated to take %ds for %d nodes, %d edges.'%(prog, est, nodes, edges)
+        if prog == 'dot':
+            return ['dot'] + DOT_FAST_ARGS, 'Preview rendered with less iterations and straight edges: ' + reason
+        elif (pydot.get_graphviz_programs() or {}).get('sfdp'):
+            return ['sfdp', '-Gsplines=false'], 'Preview rendered by sfdp: ' + reason
+        else: ### Nothing faster, just warn.
+            return [prog], 'Slow preview: ' + reason
+    
+    def EG_set_focus(self, graph=None):
+        '''Let the preview show the subgraph graph alone, with the edges between it
+        and the rest, the whole graph if None or self. Return True if changed.'''
+        
+        if graph is None or graph.obj_dict is self.obj_dict:
+            focus = None
+        else:
+            focus = graph.obj_dict
+        
+        changed = not focus is self.focus
+        self.focus = focus
+        
+        return changed
+    
+    def EG_focus_string(self, graph_obj_dict):
+        '''Script to preview the subgraph of graph_obj_dict alone: the attrs of the 
+        graph and the wildcards of the graphs above, the subgraph, and the edges 
+        declared outside it between its nodes or to other nodes. Nodes not declared
+        in the subgraph are shown by FOCUS_STUB_ATTRS. None if the subgraph is not 
+        in the graph.'''
+        
+        pieces = self.EG_focus_fragments(graph_obj_dict)
+        if pieces is None:
+            return None
+        
+        return ''.join(pieces)
+    
+    def EG_focus_fragments(self, graph_obj_dict):
+        '''Same as EG_focus_string(), return the script as a list of fragments.'''
+        
+        path = self.__find_graph_path(graph_obj_dict)
+        if path is None or len(path) < 2:
+            return None
+        
+        top = self.obj_dict
+        pieces = []
+        if top.get('strict'):
+            pieces.append('strict ')
+        pieces.append('%s %s {\n' % (top['type'], top['name']))
+        for attr, val in top['attributes'].items():
+            if not val is None:
+                pieces.append('    %s=%s;\n' % (attr, pydot.quote_if_necessary(val)))
+        
+        for g in path[:-1]:
+            for n in ['node', 'edge']:
+                for obj in g['nodes'].get(n, []):
+                    pieces.append(DEUtils.smart_indent(pydot.Node(obj_dict=obj).to_string(), ' '*4) + '\n')
+        
+        ### The subgraph pieces are cached as in the whole script.
+        pieces.extend(self.EG_iter_string(4, pydot.Subgraph(obj_dict=graph_obj_dict)))
+        
+        ### Only the nodes declared in the subgraph are inside, not the other ends 
+        ### of its edges, or the edges of those ends would be pulled in as well.
+        inner, inner_edges = set(), []
+        graphs = [graph_obj_dict]
+        while graphs:
+            g = graphs.pop()
+            for k in g['nodes']:
+                inner.add(remove_double_quote(k))
+            for e_list in g['edges'].values():
+                inner_edges.extend(e_list)
+            for sg_list in g['subgraphs'].values():
+                graphs.extend(sg_list)
+        inner.difference_update(['node', 'edge'])
+        
+        stubs, edges = [], []
+        for e in inner_edges:
+            stubs.extend([ remove_port(p) for p in e['points'] 
+                           if isinstance(p, str) and not remove_port(p) in inner ])
+        
+        graphs = [top]
+        while graphs:
+            g = graphs.pop()
+            for e_list in g['edges'].values():
+                for e in e_list:
+                    points = e['points']
+                    if not (isinstance(points[0], str) and isinstance(points[1], str)):
+                        continue
+                    names = [ remove_port(p) for p in points ]
+                    if not (names[0] in inner or names[1] in inner):
+                        continue
+                    edges.append(e)
+                    stubs.extend([ n for n in names if not n in inner ])
+            for sg_list in g['subgraphs'].values():
+                graphs.extend([ sg for sg in sg_list if not sg is graph_obj_dict ])
+        
+        for n in sorted(set(stubs)):
+            pieces.append('    %s %s;\n' % (add_double_quote(n), FOCUS_STUB_ATTRS))
+        for e in edges:
+            pieces.append(DEUtils.smart_indent(pydot.Edge(obj_dict=e).to_string(), ' '*4) + '\n')
+        
+        pieces.append('}\n')
+        
+        return pieces
+    
+    def get_draft_prog(self, prog, nodes, edges):
+        '''Return the program (with args) to render the draft of a preview by prog, 
+        None if the preview is fast enough without a draft.'''
+        
+        if DRAFT_COST_LIMIT is None or len(prog) > 1: ### Already the fast way.
+            return None
+        
+        if estimate_layout_cost(prog[0], nodes, edges) <= DRAFT_COST_LIMIT:
+            return None
+        
+        return prog + DRAFT_ARGS.get(prog[0], ['-Gsplines=false'])
+    
+    def EG_count_items(self, root_graph=None):
+        '''Return the number of nodes and edges in root_graph and its subgraphs.'''
+        if root_graph is None:
+            root_graph = self
+        
+        nodes = edges = 0
+        graphs = [root_graph.obj_dict]
+        while graphs:
+            g = graphs.pop()
+            for n_list in g['nodes'].values():
+                nodes += len(n_list)
+            for e_list in g['edges'].values():
+                edges += len(e_list)
+            for sg_list in g['subgraphs'].values():
+                graphs.extend(sg_list)
+        
+        return nodes, edges
+    
+    def EG_find_graph_path(self, graph_obj_dict):
+        '''Get obj_dicts of the graphs from self down to the graph of graph_obj_dict, 
+        None if not in self.'''
+        return self.__find_graph_path(graph_obj_dict)
+    
+    def __index_graph(self, graph_obj_dict, add=True):
+        '''Add all nodes and edges in graph_obj_dict and its subgraphs to the index, 
+        or remove them from it. Added ones go in at once by GraphIndex.add_nodes() 
+        and add_edges().'''
+        nodes, edges = [], []
+        graphs = [graph_obj_dict]
+        while graphs:
+            g = graphs.pop(0)
+            for n_list in g['nodes'].values():
+                for n in n_list:
+                    if not add:
+                        self.__index_node(g, n, add)
+                        continue
+                    name = remove_double_quote(n['name'])
+                    if not name.lower() in ['node', 'edge']: ### Skip the wildcard node.
+                        nodes.append((name, g, self.__get_label(n)))
+            
+            for e_list in g['edges'].values():
+                for e in e_list:
+                    if not add:
+                        self.__index_edge(e, add)
+                        continue
+                    src, dst = e['points']
+                    if isinstance(src, str) and isinstance(dst, str):
+                        edges.append((remove_double_quote(src), remove_double_quote(dst)))
+            
+            for sg_list in g['subgraphs'].values():
+                graphs.extend(sg_list)
+        
+        if add:
+            self.__index.add_nodes(nodes)
+            self.__index.add_edges(edges)
+        
+        return
+    
+    def __index_node(self, graph_obj_dict, node_obj_dict, add=True):
+        name = remove_double_quote(node_obj_dict['name'])
+        if name.lower() in ['node', 'edge']: ### Skip the wildcard node.
+            return
+        if add:
+            self.__index.add_node(name, graph_obj_dict, self.__get_label(node_obj_dict))
+        else:
+            self.__index.remove_node(name, graph_obj_dict)
+    
+    def __index_edge(self, edge_obj_dict, add=True):
+        src, dst = edge_obj_dict['points']
+        if not (isinstance(src, str) and isinstance(dst, str)):
+            return
+        if add:
+            self.__index.add_edge(remove_double_quote(src), remove_double_quote(dst))
+        else:
+            self.__index.remove_edge(remove_double_quote(src), remove_double_quote(dst))
+    
+    def __get_label(self, node_obj_dict):
+        label = node_obj_dict['attributes'].get('label')
+        if label is None:
+            return None
+        
+        return remove_double_quote(to_unicode(label))
+    
+    def EG_get_index(self):
+        '''Get the GraphIndex of node names, labels and edge endpoints, build it at the 1st 
+        call. Then EG_append_*, EG_remove_* and EG_index_label() keep it up to date.'''
+        if self.__index is None:
+            self.__index = GraphIndex()
+            self.__index_graph(self.obj_dict)
+        
+        return self.__index
+    
+    def EG_index_label(self, node):
+        '''Update the index after the label of node changed.'''
+        self.__index_label(node.obj_dict)
+        
+        return
+    
+    def __index_label(self, node_obj_dict):
+        if self.__index is None:
+            return
+        
+        name = remove_double_quote(node_obj_dict['name'])
+        if name in self.__index.nodes:
+            self.__index.set_label(name, self.__get_label(node_obj_dict))
+        
         return
     
     def EG_get_all_node_names(self, root_graph=None):
@@ -175,6 +950,10 @@ class ExtGraph(pydot.Dot):
         
         n = pydot.Node(uname)
         root_graph.add_node(n)
+        self.EG_mark_dirty(root_graph)
+        if not self.__index is None:
+            self.__index.add_node(remove_double_quote(n.get_name()), root_graph.obj_dict)
+        self.__record('append node', [('attach', 'node', root_graph.obj_dict, n.obj_dict)])
         
         self.__check_wildcard_existed()
         
@@ -202,6 +981,11 @@ class ExtGraph(pydot.Dot):
         e = pydot.Edge(src=nameA, dst=nameB)
         
         root_graph.add_edge(e)
+        self.EG_mark_dirty(root_graph)
+        if not self.__index is None:
+            self.__index.add_edge(remove_double_quote(e.get_source()), 
+                                  remove_double_quote(e.get_destination()))
+        self.__record('append edge', [('attach', 'edge', root_graph.obj_dict, e.obj_dict)])
         
         self.__check_wildcard_existed()
         
@@ -226,6 +1010,8 @@ class ExtGraph(pydot.Dot):
         
         sg = self.create_empty_subgraph(uname)
         root_graph.add_subgraph(sg)
+        self.EG_mark_dirty(sg)
+        self.__record('append subgraph', [('attach', 'subgraph', root_graph.obj_dict, sg.obj_dict)])
         
         self.refresh_bitmap()
         
@@ -293,10 +1079,13 @@ class ExtGraph(pydot.Dot):
 
         uname = add_double_quote( to_unicode(name) )
 
-        try:
-            del root_graph.obj_dict['nodes'][uname]
-        except:
-            pass
+        nodes = list(root_graph.obj_dict['nodes'].get(uname, []))
+        if root_graph.del_node(uname):
+            if not self.__index is None:
+                for _ in nodes:
+                    self.__index.remove_node(remove_double_quote(uname), root_graph.obj_dict)
+            self.__record('remove node', [ ('detach', 'node', root_graph.obj_dict, n) for n in nodes ])
+        self.EG_mark_dirty(root_graph)
         
         self.refresh_bitmap()
         
@@ -310,10 +1099,13 @@ class ExtGraph(pydot.Dot):
         nameA = add_double_quote( to_unicode( name_pair[0]) )
         nameB = add_double_quote( to_unicode( name_pair[1]) )
 
-        try:
-            del root_graph.obj_dict['edges'][(nameA, nameB)]
-        except:
-            pass
+        edges = list(root_graph.obj_dict['edges'].get((nameA, nameB), []))
+        if root_graph.del_edge((nameA, nameB)):
+            if not self.__index is None:
+                for _ in edges:
+                    self.__index.remove_edge(remove_double_quote(nameA), remove_double_quote(nameB))
+            self.__record('remove edge', [ ('detach', 'edge', root_graph.obj_dict, e) for e in edges ])
+        self.EG_mark_dirty(root_graph)
         
         self.refresh_bitmap()
         
@@ -326,10 +1118,13 @@ class ExtGraph(pydot.Dot):
 
         sg_name = add_double_quote( to_unicode(name) )
 
-        try:
-            del root_graph.obj_dict['subgraphs'][sg_name]
-        except:
-            pass
+        sgs = list(root_graph.obj_dict['subgraphs'].get(sg_name, []))
+        if root_graph.del_subgraph(sg_name):
+            if not self.__index is None:
+                for sg in sgs:
+                    self.__index_graph(sg, add=False)
+            self.__record('remove subgraph', [ ('detach', 'subgraph', root_graph.obj_dict, sg) for sg in sgs ])
+        self.EG_mark_dirty(root_graph)
         
         self.refresh_bitmap()
         
@@ -339,56 +1134,63 @@ class ExtGraph(pydot.Dot):
         """Returns a string representation of the graph in dot language.
         This version try to make string looking better than to_string().
         """
-        idt =  ' '*(4 + indent)
-        graph = list()
         
+        return ''.join(self.EG_iter_string(indent, root_graph))
+    
+    def EG_write(self, f, root_graph=None):
+        """Write the EG_to_string() form of the graph into file-like object 'f'.
+        The script is written piece by piece, never held in memory as a whole.
+        """
+        
+        for s in self.EG_iter_string(root_graph=root_graph):
+            f.write(s)
+        
+        return
+    
+    def EG_iter_string(self, indent=0, root_graph=None):
+        """Generate the EG_to_string() form of the graph in pieces.
+        Graphs not marked dirty since last time give their cached pieces.
+        """
         if root_graph is None:
             root_graph = self
         
+        return root_graph.iter_cached(('EG', indent), 
+                                      lambda: self.__iter_string(indent, root_graph))
+    
+    def __iter_string(self, indent, root_graph):
+        idt =  ' '*(4 + indent)
+        
         if root_graph != root_graph.get_parent_graph():
-            graph.append(' '*indent)
+            yield ' '*indent
         
         if root_graph.obj_dict.get('strict', None) is not None:
             if root_graph==root_graph.get_parent_graph() and root_graph.obj_dict['strict']:
-                graph.append('strict ')
+                yield 'strict '
         
         if root_graph.obj_dict['name'] == '':
-            graph.append( '{\n' )
+            yield '{\n'
         else:
-            graph.append( '%s %s {\n' % (root_graph.obj_dict['type'], root_graph.obj_dict['name']) )
+            yield '%s %s {\n' % (root_graph.obj_dict['type'], root_graph.obj_dict['name'])
 
         for attr in root_graph.obj_dict['attributes'].keys():
             if root_graph.obj_dict['attributes'].get(attr, None) is not None:
-                graph.append( idt+'%s=' % attr )
+                yield idt+'%s=' % attr
                 val = root_graph.obj_dict['attributes'].get(attr)
-                graph.append( pydot.quote_if_necessary(val) )
-                graph.append( ';\n' )
+                yield pydot.quote_if_necessary(val)
+                yield ';\n'
 
 
         edges_done = set()
         
-        edge_obj_dicts = list()
-        for e in root_graph.obj_dict['edges'].values():
-            edge_obj_dicts.extend(e)
-            
-        if edge_obj_dicts:
-            edge_src_set, edge_dst_set = zip( *[obj['points'] for obj in edge_obj_dicts] )
-            edge_src_set, edge_dst_set = set(edge_src_set), set(edge_dst_set)
-        else:
-            edge_src_set, edge_dst_set = set(), set()
-            
-        node_obj_dicts = list()
-        for e in root_graph.obj_dict['nodes'].values():
-            node_obj_dicts.extend(e)
-
-        sgraph_obj_dicts = list()
-        for sg in root_graph.obj_dict['subgraphs'].values():
-            sgraph_obj_dicts.extend(sg)
+        edge_src_set, edge_dst_set = set(), set()
+        if root_graph.obj_dict.get('suppress_disconnected', False):
+            for e in root_graph.obj_dict['edges'].values():
+                for obj in e:
+                    edge_src_set.add(obj['points'][0])
+                    edge_dst_set.add(obj['points'][1])
         
-        obj_list = sorted([ (obj['sequence'], obj) for obj in (edge_obj_dicts + node_obj_dicts + sgraph_obj_dicts) ])
-        # obj_list.sort()
-        
-        for _, obj in obj_list:
+        ### Children are kept in sequence order by the graph, no sort here.
+        for obj in root_graph.get_sequence_index():
             if obj['type'] == 'node':
                 node = pydot.Node(obj_dict=obj)
                 if root_graph.obj_dict.get('suppress_disconnected', False):
@@ -396,41 +1198,156 @@ class ExtGraph(pydot.Dot):
                         node.get_name() not in edge_dst_set):
                         continue
                     
-                graph.append( DEUtils.smart_indent(node.to_string(), idt) + '\n' )
+                yield DEUtils.smart_indent(node.to_string(), idt) + '\n'
 
             elif obj['type'] == 'edge':
                 edge = pydot.Edge(obj_dict=obj)
                 if root_graph.obj_dict.get('simplify', False) and edge in edges_done:
                     continue
                 
-                graph.append( DEUtils.smart_indent(edge.to_string(), idt) + '\n' )
+                yield DEUtils.smart_indent(edge.to_string(), idt) + '\n'
                 
                 edges_done.add(edge)
                 
             else:
                 sgraph = pydot.Subgraph(obj_dict=obj)
-                sg_str = self.EG_to_string(indent+4, sgraph)
-                graph.append( sg_str+'\n' )
+                for s in self.EG_iter_string(indent+4, sgraph):
+                    yield s
+                yield '\n'
 
         if root_graph != root_graph.get_parent_graph():
-            graph.append(' '*indent)
+            yield ' '*indent
+            
+        yield '}\n'
+    
+    
+    def EG_record_attr(self, item, key, old_value, root_graph=None):
+        '''Log the change of attr key of item(node, edge or graph in root_graph) 
+        from old_value, None if it was not set. Call it after the change.'''
+        if root_graph is None:
+            root_graph = self
+        
+        new_value = item.obj_dict['attributes'].get(key)
+        if new_value == old_value:
+            return
+        
+        self.__record('set %s'%key, [('attr', item.obj_dict, root_graph.obj_dict, key, old_value, new_value)])
+        
+        return
+    
+    def __record(self, label, ops):
+        '''Log a change made of ops, a new change can't be redone after undone ones.'''
+        if len(ops) == 0:
+            return
+        
+        self.__undo_log.append((label, ops))
+        if len(self.__undo_log) > UNDO_LIMIT:
+            del self.__undo_log[0]
+        self.__redo_log = []
+        
+        return
+    
+    def __as_graph(self, graph_obj_dict):
+        if graph_obj_dict is self.obj_dict:
+            return self
+        return pydot.Subgraph(obj_dict=graph_obj_dict)
+    
+    def __apply_op(self, op, forward=True):
+        '''Do op, or its inverse if not forward. An op is one of:
+            ('attach', kind, graph_obj_dict, obj_dict): obj_dict added in the graph.
+            ('detach', kind, graph_obj_dict, obj_dict): obj_dict removed from the graph.
+            ('attr', obj_dict, graph_obj_dict, key, old_value, new_value): attr changed.
+        The obj_dicts are the ones of the graph, not copies, so they come back as they were.'''
+        
+        if op[0] == 'attr':
+            _, obj, graph_obj_dict, key, old_value, new_value = op
+            v = new_value if forward else old_value
+            if v is None:
+                obj['attributes'].pop(key, None)
+            else:
+                obj['attributes'][key] = v
+            if key == 'label' and obj.get('type') == 'node':
+                self.__index_label(obj)
+            self.__mark_dirty(graph_obj_dict)
+            return
+        
+        action, kind, graph_obj_dict, obj = op
+        g = self.__as_graph(graph_obj_dict)
+        if kind == 'edge':
+            key = obj['points']
+        else:
+            key = obj['name']
+        
+        if (action == 'attach') == forward:
+            seq = obj['sequence']
+            if kind == 'node':
+                g.add_node(pydot.Node(obj_dict=obj))
+            elif kind == 'edge':
+                g.add_edge(pydot.Edge(obj_dict=obj))
+            else:
+                g.add_subgraph(pydot.Subgraph(obj_dict=obj))
+            ### Back to where it was in the script.
+            g.set_child_sequence(obj, seq)
+            add = True
             
-        graph.append( '}\n' )
+        else:
+            children = graph_obj_dict[kind+'s'][key]
+            i = [ id(c) for c in children ].index(id(obj))
+            if kind == 'node':
+                g.del_node(key, index=i)
+            elif kind == 'edge':
+                g.del_edge(key, index=i)
+            else:
+                g.del_subgraph(key, index=i)
+            if len(children) == 0:
+                del graph_obj_dict[kind+'s'][key]
+            add = False
         
-        return ''.join(graph)
+        if not self.__index is None:
+            if kind == 'node':
+                self.__index_node(graph_obj_dict, obj, add)
+            elif kind == 'edge':
+                self.__index_edge(obj, add)
+            else:
+                self.__index_graph(obj, add)
+        
+        self.__mark_dirty(graph_obj_dict)
+        
+        return
     
+    def can_undo(self):
+        return len(self.__undo_log) > 0
+    
+    def can_redo(self):
+        return len(self.__redo_log) > 0
     
     def undo_change(self, step=1):
-        "Roll back the change of the graph."
+        """Roll back the last step changes of the graph. Return the number of changes undone.
+        The bitmap is not refreshed, the caller does it once it is done."""
         
-        self.refresh_bitmap()
-        return
+        done = 0
+        while done < step and self.__undo_log:
+            label, ops = self.__undo_log.pop()
+            for op in reversed(ops):
+                self.__apply_op(op, forward=False)
+            self.__redo_log.append((label, ops))
+            done += 1
+        
+        return done
     
     def redo_change(self, step=1):
-        "Redo change on the graph."
+        """Redo the last step changes undone. Return the number of changes redone.
+        The bitmap is not refreshed, as by undo_change()."""
         
-        self.refresh_bitmap()
-        return
+        done = 0
+        while done < step and self.__redo_log:
+            label, ops = self.__redo_log.pop()
+            for op in ops:
+                self.__apply_op(op, forward=True)
+            self.__undo_log.append((label, ops))
+            done += 1
+        
+        return done
     
 if __name__ == '__main__':
 
@@ -15,7 +15,7 @@ import wx.propgrid as wxpg
 import AttrsDef
 import wx, types, colour
 import re
-from DEUtils import remove_double_quote, get_colors_in_scheme
+from DEUtils import remove_double_quote, get_colors_in_scheme, get_color_name
 from UIClass import ImageSingleChoiceDialog, ArrowTypeDialog, \
                     ColorSingleChoiceDialog, ColorSchemeDialog, \
                     DialogTextEditor
@@ -58,7 +58,7 @@ class CSDialog(ColorSchemeDialog):
         
         self.choice = AttrsDef.E_COLORSCHEME
         
-        il = get_root_window(self).image_list['colorscheme']
+        il = get_root_window(self).get_image_list('colorscheme')
         self.m_list.AssignImageList(il, 0)
         
         # Change dialog size to fit the image size.        
@@ -212,7 +212,7 @@ class NodeShapeDialog(ImageSingleChoiceDialog):
         
         self.choices = AttrsDef.E_SHAPE
         
-        il = get_root_window(self).image_list['node_shape']
+        il = get_root_window(self).get_image_list('node_shape')
         self.m_list.AssignImageList(il, 0)
 
         # Change dialog size to fit the image size.        
@@ -273,7 +273,7 @@ class ATDialog(ArrowTypeDialog):
         ArrowTypeDialog.__init__(self, parent)
         self.base_at_list = AttrsDef.E_ARROWTYPE
         
-        il = get_root_window(self).image_list['arrow_style']
+        il = get_root_window(self).get_image_list('arrow_style')
         self.m_list.AssignImageList(il, 0)
 
         # Change dialog size to fit the image size.        
@@ -590,12 +590,12 @@ class DotColorProperty(wxpg.PGProperty):
             if scheme is None:
                 return True, s
             
-            colors = get_colors_in_scheme(scheme).keys()
+            colors = get_colors_in_scheme(scheme)
             
             if s.strip() not in colors:
                 return False
             
-            return True, get_colors_in_scheme(scheme)[s]
+            return True, colors[s]
 
     def ValueToString(self, value, flags):
 
@@ -649,6 +649,10 @@ class DotColorProperty(wxpg.PGProperty):
             
             if isinstance(self.m_value, str):
                 dlg.SetColorString(self.m_value)
+            elif isinstance(self.m_value, tuple):
+                c_name = get_color_name(self.m_value, scheme)
+                if not c_name is None:
+                    dlg.SetColorString(c_name)
             
         return False    
     
@@ -0,0 +1,111 @@
+# coding=utf8
+'''
+Copyright (R) 2021 Vaibhav.Gilhotra <spaceholder_email>
+
+Published under Apache 2.0 License (http://www.apache.org/licenses/LICENSE-2.0.html).
+-------------------------------------------------------------------------------------
+
+Process dot files without the UI: parse, normalize to the script form saved by 
+DotEditor, lint and render them, in several processes.
+
+    python batch.py [-j N] [--check | -o OUT_DIR] [-T png -T svg] [--prog dot] FILE...
+
+--check only reports the files which aren't in normalized form, and exits with 
+code 1 if any, for CI. Without it, the normalized scripts are written into 
+OUT_DIR, and the images of the -T formats into OUT_DIR or next to the files.
+'''
+
+import os, sys, time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import ExtParser
+import ExtGraph
+from DEUtils import atomic_save
+
+
+def process_file(fp, out_dir=None, formats=(), prog=None, check=False):
+    '''Process one file, return (fp, {phase: seconds}, status, message). Status is 
+    'ok', 'changed' if not normalized and check, or 'error' with the message.'''
+    
+    times = {}
+    try:
+        t = time.time()
+        g = ExtParser.parse_file(fp)
+        times['parse'] = time.time() - t
+        
+        t = time.time()
+        graph = ExtGraph.ExtGraph(obj_dict=g.obj_dict, render=False)
+        script = graph.EG_to_string()
+        times['normalize'] = time.time() - t
+        
+        if check:
+            with open(fp) as f:
+                if f.read() != script:
+                    return fp, times, 'changed', ''
+            return fp, times, 'ok', ''
+        
+        name = os.path.splitext(os.path.basename(fp))[0]
+        if not out_dir is None:
+            atomic_save(os.path.join(out_dir, name+'.dot'), graph.EG_write, backup=False)
+        
+        if formats:
+            t = time.time()
+            if prog is None:
+                prog = graph.prog
+            if len(formats) == 1:
+                outputs = [ ExtGraph.render_script(script, prog, formats[0]) ]
+            else: ### One layout for all the formats.
+                layout = ExtGraph.layout_script(script, prog)
+                outputs = [ ExtGraph.render_layout(layout, f) for f in formats ]
+            for f, data in zip(formats, outputs):
+                with open(os.path.join(out_dir or os.path.dirname(fp), name+'.'+f), 'wb') as of:
+                    of.write(data)
+            times['render'] = time.time() - t
+        
+    except Exception as ex:
+        return fp, times, 'error', (str(ex).strip() or type(ex).__name__).splitlines()[0]
+    
+    return fp, times, 'ok', ''
+
+def run(files, jobs=None, out_dir=None, formats=(), prog=None, check=False, out=sys.stdout):
+    '''Process files in jobs processes(cpu count if None), print a line of timing 
+    for each file as it's done. Return the number of files not ok.'''
+    
+    if not out_dir is None and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    
+    failed = 0
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [ pool.submit(process_file, fp, out_dir, formats, prog, check) for fp in files ]
+        for fu in futures:
+            fp, times, status, message = fu.result()
+            if status != 'ok':
+                failed += 1
+            phases = '  '.join([ '%s %7.3fs'%(k, v) for k, v in times.items() ])
+            out.write('%-40s %-8s %s\n'%(fp, status, phases))
+            if message:
+                out.write('    %s\n'%message)
+    
+    out.write('%d files, %d not ok, %.3fs\n'%(len(files), failed, time.time() - start))
+    
+    return failed
+
+def main(argv=None):
+    
+    ap = argparse.ArgumentParser(description='Parse, normalize, lint and render dot files without the UI.')
+    ap.add_argument('files', nargs='+', help='dot files')
+    ap.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, cpu count by default')
+    ap.add_argument('-o', '--out-dir', default=None, help='write the normalized scripts and images here')
+    ap.add_argument('-T', dest='formats', action='append', default=[], help='render in format, may repeat')
+    ap.add_argument('--prog', default=None, help='graphviz program, the one of each graph by default')
+    ap.add_argument('--check', action='store_true', help='only report files not in normalized form')
+    args = ap.parse_args(argv)
+    
+    failed = run(args.files, args.jobs, args.out_dir, args.formats, args.prog, args.check)
+    
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# coding=utf8
+'''
+Copyright (R) 2021 Vaibhav.Gilhotra <spaceholder_email>
+
+Published under Apache 2.0 License (http://www.apache.org/licenses/LICENSE-2.0.html).
+-------------------------------------------------------------------------------------
+
+Benchmarks of the hot paths of DE on synthetic graphs, results in JSON to be 
+compared across commits.
+
+    python bench.py [--sizes small,labels] [--repeat 5] [-o result.json] [--compare old.json]
+
+Graphs are made by gen_script(), sized by SIZES. The cases needing wx or 
+graphviz are skipped when they are not there.
+'''
+
+import os, sys, time, json
+import random, platform, subprocess
+import argparse
+
+import ExtParser
+import ExtGraph
+import pydot
+from DEUtils import smart_indent
+
+
+### name: (nodes, edges, depth of subgraph nesting, label size)
+SIZES = {'small':  (100,   150,   2, 8),
+         'medium': (1000,  1500,  3, 16),
+         'large':  (10000, 15000, 4, 32),
+         'labels': (500,   500,   1, 1024),
+         }
+
+### Lookups timed by each EG_get_* case.
+LOOKUPS = 100
+
+def gen_script(nodes, edges, depth, label_size, seed=0):
+    '''Generate a dot script of nodes spread evenly over the top graph and 
+    clusters nested depth deep, and edges between random nodes, each node 
+    with a label of label_size chars. Same arguments, same script.'''
+    
+    rnd = random.Random(seed)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', '\\"quoted\\"', 'back\\\\slash']
+    
+    def label():
+        s = ''
+        while len(s) < label_size:
+            s += rnd.choice(words) + ' '
+        ### Not to end in the middle of an escape.
+        return s[:label_size].rstrip('\\')
+    
+    levels = depth + 1
+    lines = ['digraph G {', 'node [shape=box];']
+    for level in range(levels):
+        if level > 0:
+            lines.append('subgraph cluster_%d {'%level)
+            lines.append('label="cluster %d";'%level)
+        for i in range(level, nodes, levels):
+            lines.append('n%d [label="%s"];'%(i, label()))
+    lines.extend(['}']*depth)
+    for _ in range(edges):
+        lines.append('n%d -> n%d [label="%s"];'%(rnd.randrange(nodes), rnd.randrange(nodes), label()))
+    lines.append('}')
+    
+    return '\n'.join(lines) + '\n'
+
+def time_case(func, repeat, setup=None):
+    '''Run func repeat times, return the seconds of each run. setup() runs before
+    each, out of the timing.'''
+    
+    times = []
+    for _ in range(repeat):
+        if not setup is None:
+            setup()
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    
+    return times
+
+def get_cases(script):
+    '''Return [(case name, func, setup)] for script, setup may be None.'''
+    
+    ### Not rendered on creation, a render is timed by its own case only.
+    graph = ExtGraph.ExtGraph(obj_dict=ExtParser.parse_string(script).obj_dict, render=False)
+    
+    rnd = random.Random(1)
+    names = [ n.get_name() for n in graph.get_nodes() if not n.get_name() in ['node', 'edge'] ]
+    node_names = [ rnd.choice(names) for _ in range(LOOKUPS) ] if names else []
+    edges = graph.get_edges()
+    edge_names = [ (e.get_source(), e.get_destination()) for e in [ rnd.choice(edges) for _ in range(LOOKUPS) ] ] if edges else []
+    
+    def get_nodes():
+        for n in node_names:
+            graph.EG_get_node_by_name(n)
+    
+    def get_edges():
+        for e in edge_names:
+            graph.EG_get_edge_by_names(e)
+    
+    def mark_dirty():
+        graph.EG_mark_dirty(recursive=True)
+    
+    cases = [('parse_string',           lambda: ExtParser.parse_string(script), None),
+             ('EG_to_string cold',      graph.EG_to_string, mark_dirty),
+             ('EG_to_string warm',      graph.EG_to_string, None),
+             ('pydot to_string cold',   lambda: pydot.Dot.to_string(graph), mark_dirty),
+             ('EG_get_node_by_name',    get_nodes, None),
+             ('EG_get_edge_by_names',   get_edges, None),
+             ('EG_get_all_node_names',  graph.EG_get_all_node_names, None),
+             ('smart_indent',           lambda: smart_indent(script, ' '*4), None),
+             ]
+    
+    if pydot.find_graphviz():
+        cases.append(('render png', lambda: graph.create(graph.prog, 'png'), None))
+    
+    if not ExtGraph.wx is None and pydot.find_graphviz():
+        ### The png of the same script is cached, so change it each time.
+        cases.append(('refresh_bitmap', graph.refresh_bitmap, mark_dirty_and_touch(graph)))
+    
+    try:
+        import DotScriptEditor
+        cases.append(('DS highlight lexing', lambda: DotScriptEditor.parse_dot(script), None))
+    except ImportError:
+        pass
+    
+    return cases
+
+def mark_dirty_and_touch(graph):
+    
+    def setup():
+        graph.set('comment', '"bench %f"'%time.time())
+        graph.EG_mark_dirty()
+    
+    return setup
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], 
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def run(sizes, repeat, out=sys.stdout):
+    '''Run all the cases on the graphs of sizes, return the results as a dict.'''
+    
+    results = []
+    for size in sizes:
+        params = SIZES[size]
+        script = gen_script(*params)
+        for name, func, setup in get_cases(script):
+            times = time_case(func, repeat, setup)
+            times.sort()
+            r = {'size':size, 'case':name, 'params':dict(zip(['nodes', 'edges', 'depth', 'label_size'], params)), 
+                 'repeat':repeat, 'min':times[0], 'median':times[len(times)//2]}
+            results.append(r)
+            out.write('%-8s %-24s min %9.4fs  median %9.4fs\n'%(size, name, r['min'], r['median']))
+    
+    return {'commit':get_commit(), 'time':time.strftime('%Y-%m-%d %H:%M:%S'), 
+            'python':platform.python_version(), 'platform':platform.platform(),
+            'results':results}
+
+def compare(old, new, out=sys.stdout):
+    '''Print the median of each case in new against old, the ratio > 1 is slower.'''
+    
+    old_r = dict( ((r['size'], r['case']), r) for r in old['results'] )
+    out.write('\nAgainst %s:\n'%(old.get('commit') or old.get('time')))
+    for r in new['results']:
+        o = old_r.get((r['size'], r['case']))
+        if o is None or o['median'] == 0:
+            continue
+        ratio = r['median']/o['median']
+        out.write('%-8s %-24s %9.4fs -> %9.4fs  x%.2f%s\n'%(r['size'], r['case'], o['median'], 
+                                                            r['median'], ratio, ' !' if ratio > 1.2 else ''))
+    
+    return
+
+def main(argv=None):
+    
+    ap = argparse.ArgumentParser(description='Benchmark the hot paths of DE on synthetic graphs.')
+    ap.add_argument('--sizes', default='small', help='comma separated of %s'%', '.join(sorted(SIZES)))
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('-o', '--out', default=None, help='write the results in JSON')
+    ap.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    args = ap.parse_args(argv)
+    
+    if not ExtGraph.wx is None: ### The bitmaps of refresh_bitmap need it.
+        app = ExtGraph.wx.App(False)
+    
+    result = run([ s.strip() for s in args.sizes.split(',') ], args.repeat)
+    
+    if not args.out is None:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=1)
+    
+    if not args.compare is None:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+    
+    if not ExtGraph.wx is None:
+        app.Destroy()
+    
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,9 @@ REM
 REM  Published under Apache 2.0 License (http://www.apache.org/licenses/LICENSE-2.0.html).
 REM
 
+REM Pack the pg dialog images into resource/sprite, bundled with resource.
+python tools.py sprite || exit /b 1
+
 pyinstaller pyinstaller_win.spec
 
 pause
\ No newline at end of file
@@ -5,6 +5,9 @@
 ### Published under Apache 2.0 License (http://www.apache.org/licenses/LICENSE-2.0.html).
 ### -------------------------------------------------------------------------------------
 
+# Pack the pg dialog images into resource/sprite, bundled with resource.
+python tools.py sprite || exit 1
+
 # Build DotEditor.app
 pyinstaller pyinstaller_mac.spec
 
@@ -101,6 +101,7 @@ def push_top_graph_stmt(strng, loc, toks):
             g.obj_dict['edges'].update( element.obj_dict['edges'] )
             g.obj_dict['nodes'].update( element.obj_dict['nodes'] )
             g.obj_dict['subgraphs'].update( element.obj_dict['subgraphs'] )
+            g.invalidate_sequence_index()
             
             g.set_parent_graph(g)
             
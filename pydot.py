@@ -1,14 +1,19 @@
 """An interface to GraphViz."""
 from __future__ import division
 from __future__ import print_function
+import bisect
 import copy
 import io
 import errno
+import functools
+import json
 import os
 import re
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import warnings
 
 try:
@@ -89,6 +94,15 @@ DEFAULT_PROGRAMS = {
     'sfdp',
 }
 
+# The programs found by `find_graphviz` are kept in this file, so
+# the next launch can skip the search. See `find_graphviz`.
+GRAPHVIZ_CACHE_FILE = os.path.join(
+    os.path.expanduser('~'), '.DotEditor', 'graphviz.json')
+
+# Absolute paths of the programs, resolved once by
+# `get_graphviz_programs` and used by `call_graphviz`.
+_graphviz_programs = None
+
 
 def is_windows():
     # type: () -> bool
@@ -109,13 +123,30 @@ def get_executable_extension():
         return '.bat'
 
 
-def call_graphviz(program, arguments, working_dir, **kwargs):
+def call_graphviz(program, arguments, working_dir,
+                  input_fragments=None, input_encoding=None,
+                  timeout=None, cancel=None, **kwargs):
     # explicitly inherit `$PATH`, on Windows too,
     # with `shell=False`
+    #
+    # If `input_fragments` is given, the strings it yields are
+    # streamed into the stdin of the program while it runs.
+    #
+    # The program is killed if it runs longer than `timeout` seconds
+    # or once `cancel` (a threading.Event) is set, and
+    # InvocationException is raised then.
+    #
+    # The returned process also tells how the run went:
+    # `process.wall_time` in seconds and `process.max_rss`, the
+    # peak resident memory in kilobytes (None if unknown).
 
     if program in DEFAULT_PROGRAMS:
-        extension = get_executable_extension()
-        program += extension
+        progs = get_graphviz_programs()
+        if progs and progs.get(program):
+            program = progs[program]
+        else:
+            extension = get_executable_extension()
+            program += extension
 
     if arguments is None:
         arguments = []
@@ -127,6 +158,11 @@ def call_graphviz(program, arguments, working_dir, **kwargs):
 
     program_with_args = [program, ] + arguments
 
+    # stdin is always a pipe, for the output is drained by
+    # _stream_to_process() which reaps the process itself.
+    kwargs['stdin'] = subprocess.PIPE
+
+    start = time.time()
     process = subprocess.Popen(
         program_with_args,
         env=env,
@@ -136,11 +172,117 @@ def call_graphviz(program, arguments, working_dir, **kwargs):
         stdout=subprocess.PIPE,
         **kwargs
     )
-    stdout_data, stderr_data = process.communicate()
+
+    stdout_data, stderr_data = _stream_to_process(
+        process, input_fragments or [], input_encoding or 'utf-8',
+        timeout, cancel)
+    process.wall_time = time.time() - start
 
     return stdout_data, stderr_data, process
 
 
+def _wait_process(process):
+    """Wait for `process` to exit and keep its resource usage.
+
+    Sets `process.max_rss`, the peak resident memory of the
+    process in kilobytes, or None where os.wait4() is missing.
+    """
+
+    process.max_rss = None
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return
+
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Reaped already, by a signal handler for instance.
+        process.wait()
+        return
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        process.max_rss = usage.ru_maxrss // 1024
+    else:
+        process.max_rss = usage.ru_maxrss
+
+
+def _stream_to_process(process, fragments, encoding,
+                       timeout=None, cancel=None):
+    """Write `fragments` into the stdin of a running `process`.
+
+    stdout and stderr are drained by threads while writing, so the
+    program can't block on a full pipe before its input is done.
+    Returns the data read from stdout and stderr.
+
+    The process is killed when it runs over `timeout` seconds or
+    `cancel` is set, then InvocationException tells which.
+    """
+
+    output = dict()
+    start = time.time()
+
+    def stop_reason():
+        if cancel is not None and cancel.is_set():
+            return 'was cancelled'
+        if timeout is not None and time.time() - start > timeout:
+            return 'timed out after {0}s'.format(timeout)
+        return None
+
+    def drain(name, pipe):
+        output[name] = pipe.read()
+        pipe.close()
+
+    readers = [
+        threading.Thread(target=drain, args=('stdout', process.stdout)),
+        threading.Thread(target=drain, args=('stderr', process.stderr)),
+    ]
+    for t in readers:
+        t.daemon = True
+        t.start()
+
+    reason = None
+    try:
+        for s in fragments:
+            reason = stop_reason()
+            if reason is not None:
+                break
+            process.stdin.write(s.encode(encoding))
+    except (IOError, OSError) as e:
+        # The program quit before reading all of its input, the
+        # return code and stderr will tell the caller why.
+        if e.errno not in (errno.EPIPE, errno.EINVAL):
+            raise
+    finally:
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+
+    for t in readers:
+        while reason is None:
+            t.join(0.05)
+            if not t.is_alive():
+                break
+            reason = stop_reason()
+    if reason is not None:
+        # The readers are left to end with the pipes, a child of the
+        # program may still hold them.
+        process.kill()
+    _wait_process(process)
+
+    if reason is not None:
+        raise InvocationException('"{prog}" {reason}.'.format(
+            prog=os.path.basename(process.args[0]), reason=reason))
+
+    return output.get('stdout', b''), output.get('stderr', b'')
+
+
 def __find_executables(path):
     """Used by find_graphviz
     
@@ -196,7 +338,136 @@ def __find_executables(path):
 
 
 
-def find_graphviz():
+def get_graphviz_programs():
+    """Return the absolute paths of Graphviz's executables.
+
+    They are looked up by `find_graphviz` at the first call only.
+    Returns an empty dict if Graphviz can't be found.
+    """
+    global _graphviz_programs
+
+    if _graphviz_programs is None:
+        _graphviz_programs = find_graphviz() or dict()
+
+    return _graphviz_programs
+
+
+def get_graphviz_versions():
+    """Return the version string of each program found by
+    `find_graphviz`, as kept in `GRAPHVIZ_CACHE_FILE`."""
+
+    cache = _read_graphviz_cache()
+    if cache is None:
+        return dict()
+
+    return cache['versions']
+
+
+def _get_program_version(path):
+    """Version string printed by `<path> -V`, '' if it fails."""
+
+    try:
+        process = subprocess.Popen(
+            [path, '-V'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout_data, stderr_data = process.communicate()
+    except (IOError, OSError):
+        return ''
+
+    # Graphviz prints the version to stderr.
+    return (stderr_data or stdout_data).decode('utf-8', 'replace').strip()
+
+
+def _read_graphviz_cache():
+    """Read `GRAPHVIZ_CACHE_FILE`.
+
+    Returns None if there is no cache, or it is stale: the `PATH`
+    changed, or any program is missing or has another mtime.
+    """
+
+    try:
+        with open(GRAPHVIZ_CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+
+        if cache['path_env'] != os.environ.get('PATH', ''):
+            return None
+
+        for prg, path in cache['programs'].items():
+            if os.path.getmtime(path) != cache['mtimes'][prg]:
+                return None
+
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+    return cache
+
+
+def _write_graphviz_cache(progs):
+    """Keep `progs` found by `find_graphviz` with their
+    mtimes and versions in `GRAPHVIZ_CACHE_FILE`."""
+
+    programs = dict()
+    for prg, path in progs.items():
+        path = path.strip('"')
+        if path:
+            programs[prg] = os.path.abspath(path)
+
+    cache = {
+        'path_env': os.environ.get('PATH', ''),
+        'programs': programs,
+        'mtimes': dict(
+            (prg, os.path.getmtime(path))
+            for prg, path in programs.items()),
+        'versions': dict(
+            (prg, _get_program_version(path))
+            for prg, path in programs.items()),
+    }
+
+    try:
+        cache_dir = os.path.dirname(GRAPHVIZ_CACHE_FILE)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        tmp_file = GRAPHVIZ_CACHE_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_file, GRAPHVIZ_CACHE_FILE)
+
+    except (IOError, OSError):
+        # No writable home, search again at the next launch.
+        pass
+
+    return programs
+
+
+def find_graphviz(use_cache=True):
+    """Locate Graphviz's executables in the system.
+
+    If `use_cache`, the result kept in `GRAPHVIZ_CACHE_FILE` by an
+    earlier call is returned while it is still valid, see
+    `_read_graphviz_cache`. Otherwise the search below is done and
+    its result (with absolute paths) kept there.
+
+    Returns a dictionary containing the program names as keys and
+    their absolute paths as values. If this fails, it returns None.
+    """
+    global _graphviz_programs
+
+    if use_cache:
+        cache = _read_graphviz_cache()
+        if cache is not None and cache['programs']:
+            _graphviz_programs = cache['programs']
+            return dict(_graphviz_programs)
+
+    progs = _search_graphviz()
+    if progs is None:
+        return None
+
+    _graphviz_programs = _write_graphviz_cache(progs)
+
+    return dict(_graphviz_programs)
+
+
+def _search_graphviz():
     """Locate Graphviz's executables in the system.
     
     Tries three methods:
@@ -426,6 +697,77 @@ class frozendict(dict):
         return "frozendict(%s)" % dict.__repr__(self)
 
 
+
+class SequenceIndex(object):
+    """Children of a graph kept ordered by their 'sequence'.
+
+    Holds the obj_dict of every node, edge and subgraph of a graph
+    sorted by sequence number, so serialization can walk the
+    children in order without sorting them on every call.
+
+    Children are appended in increasing sequence order by the
+    graph's add_*() methods, so insertion is normally O(1).
+    Removal is done by identity, never by equality, as two
+    obj_dicts may hold the very same content.
+    """
+
+    def __init__(self, obj_dicts=()):
+
+        self.keys = list()
+        self.objs = list()
+
+        for obj in sorted(obj_dicts, key=lambda o: o['sequence']):
+            self.keys.append(obj['sequence'])
+            self.objs.append(obj)
+
+
+    def __len__(self):
+
+        return len(self.objs)
+
+
+    def __iter__(self):
+
+        return iter(list(self.objs))
+
+
+    def add(self, obj):
+        """Insert a child obj_dict at the place of its sequence."""
+
+        seq = obj['sequence']
+
+        if not self.keys or seq >= self.keys[-1]:
+            self.keys.append(seq)
+            self.objs.append(obj)
+        else:
+            idx = bisect.bisect_right(self.keys, seq)
+            self.keys.insert(idx, seq)
+            self.objs.insert(idx, obj)
+
+
+    def remove(self, obj):
+        """Remove a child obj_dict. Returns False if not indexed."""
+
+        seq = obj['sequence']
+
+        idx = bisect.bisect_left(self.keys, seq)
+        while idx < len(self.keys) and self.keys[idx] == seq:
+            if self.objs[idx] is obj:
+                del self.keys[idx]
+                del self.objs[idx]
+                return True
+            idx += 1
+
+        # Sequence changed behind our back, fall back to a full scan.
+        for idx, o in enumerate(self.objs):
+            if o is obj:
+                del self.keys[idx]
+                del self.objs[idx]
+                return True
+
+        return False
+
+
 dot_keywords = ['graph', 'subgraph', 'digraph', 'node', 'edge', 'strict']
 
 id_re_alpha_nums = re.compile('^[_a-zA-Z][a-zA-Z0-9_,]*$', re.UNICODE)
@@ -436,7 +778,19 @@ id_re_with_port = re.compile('^([^:]*):([^:]*)$', re.UNICODE)
 id_re_dbl_quoted = re.compile('^\".*\"$', re.S|re.UNICODE)
 id_re_html = re.compile('^<.*>$', re.S|re.UNICODE)
 
+# All the IDs above that never need quotes, tried in a single match.
+# Only the quoted and the HTML forms can hold non ASCII characters.
+id_re_no_quotes = re.compile(
+    '^(?:[_a-zA-Z][a-zA-Z0-9_,]*|[0-9,]+|\".*\"|<.*>|'
+    '[_a-zA-Z][a-zA-Z0-9_,:\"]*[a-zA-Z0-9_,\"]+)$', re.S|re.UNICODE)
+id_re_non_ascii = re.compile('[^\x01-\x7f]', re.UNICODE)
+
+# Bound of the memo of quoting decisions. The same attribute values
+# and names come back on every serialization of a graph.
+QUOTE_CACHE_SIZE = 8192
 
+
+@functools.lru_cache(maxsize=QUOTE_CACHE_SIZE)
 def needs_quotes( s ):
     """Checks whether a string is a dot language ID.
 
@@ -456,15 +810,11 @@ def needs_quotes( s ):
     if s in dot_keywords:
         return False
 
-    chars = [ord(c) for c in s if ord(c)>0x7f or ord(c)==0]
-    if chars and not id_re_dbl_quoted.match(s) and not id_re_html.match(s):
-        return True
+    if id_re_no_quotes.match(s):
+        return False
 
-    for test_re in [id_re_alpha_nums, id_re_num,
-                    id_re_dbl_quoted, id_re_html,
-                    id_re_alpha_nums_with_ports]:
-        if test_re.match(s):
-            return False
+    if id_re_non_ascii.search(s):
+        return True
 
     m = id_re_with_port.match(s)
     if m:
@@ -486,6 +836,12 @@ def quote_if_necessary(s):
     if not s:
         return s
 
+    return _quote_str(s)
+
+
+@functools.lru_cache(maxsize=QUOTE_CACHE_SIZE)
+def _quote_str(s):
+
     if needs_quotes(s):
         replace = {'"'  : r'\"',
                    "\n" : r'\n',
@@ -1173,6 +1529,7 @@ class Graph(Common):
             self.obj_dict['nodes'] = dict()
             self.obj_dict['edges'] = dict()
             self.obj_dict['subgraphs'] = dict()
+            self.obj_dict['sequence_index'] = SequenceIndex()
 
             self.set_parent_graph(self)
 
@@ -1350,6 +1707,129 @@ class Graph(Common):
         return seq
 
 
+    def get_sequence_index(self):
+        """Get the children obj_dicts ordered by sequence.
+
+        The index is maintained by add_*() and del_*(). Whoever
+        modifies the 'nodes', 'edges' or 'subgraphs' dicts directly
+        (as the parser does when merging graph bodies) must call
+        invalidate_sequence_index(), the index is then rebuilt once
+        at the next call.
+        """
+
+        index = self.obj_dict.get('sequence_index', None)
+        if index is not None:
+            return index
+
+        obj_dicts = list()
+        for k in ('edges', 'nodes', 'subgraphs'):
+            for obj_list in self.obj_dict[k].values():
+                obj_dicts.extend(obj_list)
+
+        index = SequenceIndex(obj_dicts)
+
+        # A frozendict can't store it, just use it this time.
+        if not isinstance(self.obj_dict, frozendict):
+            self.obj_dict['sequence_index'] = index
+
+        return index
+
+
+    def invalidate_sequence_index(self):
+        """Drop the sequence index after a direct change of the children."""
+
+        if not isinstance(self.obj_dict, frozendict):
+            self.obj_dict['sequence_index'] = None
+
+        self.__touch()
+
+
+    def set_child_sequence(self, obj_dict, seq):
+        """Change the sequence of a child and keep the index ordered."""
+
+        index = self.get_sequence_index()
+        index.remove(obj_dict)
+        obj_dict['sequence'] = seq
+        index.add(obj_dict)
+
+        self.__touch()
+
+
+    def __index_child(self, obj_dict):
+
+        self.get_sequence_index().add(obj_dict)
+
+        self.__touch()
+
+
+    def __unindex_children(self, obj_dicts):
+
+        index = self.get_sequence_index()
+        for obj in obj_dicts:
+            index.remove(obj)
+
+        self.__touch()
+
+
+    def __touch(self):
+
+        if 'dirty' in self.obj_dict:
+            self.obj_dict['dirty'] = True
+
+
+    def set_dirty(self, dirty=True):
+        """Mark the cached DOT string of the graph as stale.
+
+        A graph caches its DOT string only once it has been marked
+        with this method. From then on, whoever changes the graph
+        must mark it again, and mark every graph containing it too,
+        as their strings include this one. The add_*() and del_*()
+        methods mark the graph itself.
+        """
+
+        self.obj_dict['dirty'] = dirty
+
+
+    def is_dirty(self):
+        """Get whether the cached DOT string of the graph is stale."""
+
+        return self.obj_dict.get('dirty', True)
+
+
+    def iter_cached(self, key, make_fragments):
+        """Generate the fragments of `make_fragments()` through the cache.
+
+        While the graph is not dirty, the fragments generated the
+        last time for the same `key` are given again instead of
+        calling `make_fragments`. Fragments are cached as a list of
+        the strings yielded, so the string of a subgraph is shared
+        with the lists of the graphs containing it, not copied.
+        """
+
+        if ('dirty' not in self.obj_dict or
+                isinstance(self.obj_dict, frozendict)):
+            for s in make_fragments():
+                yield s
+            return
+
+        cache = self.obj_dict.get('string_cache', None)
+        if self.obj_dict['dirty'] or cache is None:
+            cache = self.obj_dict['string_cache'] = dict()
+            self.obj_dict['dirty'] = False
+
+        if key in cache:
+            for s in cache[key]:
+                yield s
+            return
+
+        fragments = list()
+        for s in make_fragments():
+            fragments.append(s)
+            yield s
+
+        cache[key] = fragments
+
+
 
     def add_node(self, graph_node):
         """Adds a node object to the graph.
@@ -1381,6 +1861,8 @@ class Graph(Common):
 
         graph_node.set_sequence(self.get_next_sequence_number())
 
+        self.__index_child(graph_node.obj_dict)
+
 
 
     def del_node(self, name, index=None):
@@ -1408,9 +1890,12 @@ class Graph(Common):
 
             if (index is not None and
                 index < len(self.obj_dict['nodes'][name])):
+                self.__unindex_children(
+                    [self.obj_dict['nodes'][name][index]])
                 del self.obj_dict['nodes'][name][index]
                 return True
             else:
+                self.__unindex_children(self.obj_dict['nodes'][name])
                 del self.obj_dict['nodes'][name]
                 return True
 
@@ -1492,6 +1977,8 @@ class Graph(Common):
 
         graph_edge.set_parent_graph( self.get_parent_graph() )
 
+        self.__index_child(graph_edge.obj_dict)
+
 
 
     def del_edge(self, src_or_list, dst=None, index=None):
@@ -1528,9 +2015,12 @@ class Graph(Common):
 
             if (index is not None and
                 index < len(self.obj_dict['edges'][(src, dst)])):
+                self.__unindex_children(
+                    [self.obj_dict['edges'][(src, dst)][index]])
                 del self.obj_dict['edges'][(src, dst)][index]
                 return True
             else:
+                self.__unindex_children(self.obj_dict['edges'][(src, dst)])
                 del self.obj_dict['edges'][(src, dst)]
                 return True
 
@@ -1623,7 +2113,39 @@ class Graph(Common):
 
         sgraph.set_parent_graph( self.get_parent_graph() )
 
+        self.__index_child(sgraph.obj_dict)
+
+
+
 
+    def del_subgraph(self, name, index=None):
+        """Delete a subgraph from the graph.
+
+        Given a subgraph's name all subgraph(s) with that same
+        name will be deleted if 'index' is not specified or set
+        to None. Works as del_node() otherwise.
+
+        If subgraphs are deleted it returns True. If no action
+        is taken it returns False.
+        """
+
+        if isinstance(name, Graph):
+            name = name.get_name()
+
+        if name in self.obj_dict['subgraphs']:
+
+            if (index is not None and
+                index < len(self.obj_dict['subgraphs'][name])):
+                self.__unindex_children(
+                    [self.obj_dict['subgraphs'][name][index]])
+                del self.obj_dict['subgraphs'][name][index]
+                return True
+            else:
+                self.__unindex_children(self.obj_dict['subgraphs'][name])
+                del self.obj_dict['subgraphs'][name]
+                return True
+
+        return False
 
 
     def get_subgraph(self, name):
@@ -1703,15 +2225,38 @@ class Graph(Common):
         @rtype: `str`
         """
 
+        return ''.join(self.iter_string())
+
+
+    def write_string(self, f):
+        """Write the DOT representation of the graph into `f`.
+
+        `f` may be any file-like object with a `write` method
+        taking `str`. The graph is written fragment by fragment,
+        it's never held in memory as a whole.
+        """
+
+        for s in self.iter_string():
+            f.write(s)
+
+
+    def iter_string(self):
+        """Generate the DOT representation of the graph in fragments.
+
+        Joining all the fragments gives the result of to_string().
+        """
+
+        return self.iter_cached('to_string', self.__iter_string)
+
 
-        graph = list()
+    def __iter_string(self):
 
         if self.obj_dict.get('strict', None) is not None:
 
             if (self == self.get_parent_graph() and
                     self.obj_dict['strict']):
 
-                graph.append('strict ')
+                yield 'strict '
 
         graph_type = self.obj_dict['type']
         if (graph_type == 'subgraph' and
@@ -1720,7 +2265,7 @@ class Graph(Common):
         s = '{type} {name} {{\n'.format(
             type=graph_type,
             name=self.obj_dict['name'])
-        graph.append(s)
+        yield s
 
         for attr in sorted(self.obj_dict['attributes']):
 
@@ -1730,42 +2275,23 @@ class Graph(Common):
                 if val == '':
                     val = '""'
                 if val is not None:
-                    graph.append('%s=%s' %
-                                 (attr, quote_if_necessary(val)))
+                    yield '%s=%s' % (attr, quote_if_necessary(val))
                 else:
-                    graph.append( attr )
+                    yield attr
 
-                graph.append( ';\n' )
+                yield ';\n'
 
 
         edges_done = set()
 
-        edge_obj_dicts = list()
-        for k in self.obj_dict['edges']:
-            edge_obj_dicts.extend(self.obj_dict['edges'][k])
-
-        if edge_obj_dicts:
-            edge_src_set, edge_dst_set = list(zip(
-                *[obj['points'] for obj in edge_obj_dicts]))
-            edge_src_set, edge_dst_set = set(edge_src_set), set(edge_dst_set)
-        else:
-            edge_src_set, edge_dst_set = set(), set()
-
-        node_obj_dicts = list()
-        for k in self.obj_dict['nodes']:
-            node_obj_dicts.extend(self.obj_dict['nodes'][k])
-
-        sgraph_obj_dicts = list()
-        for k in self.obj_dict['subgraphs']:
-            sgraph_obj_dicts.extend(self.obj_dict['subgraphs'][k])
-
-
-        obj_list = [(obj['sequence'], obj)
-                    for obj in (edge_obj_dicts +
-                                node_obj_dicts + sgraph_obj_dicts) ]
-        obj_list.sort(key=lambda x: x[0])
+        edge_src_set, edge_dst_set = set(), set()
+        if self.obj_dict.get('suppress_disconnected', False):
+            for k in self.obj_dict['edges']:
+                for obj in self.obj_dict['edges'][k]:
+                    edge_src_set.add(obj['points'][0])
+                    edge_dst_set.add(obj['points'][1])
 
-        for idx, obj in obj_list:
+        for obj in self.get_sequence_index():
 
             if obj['type'] == 'node':
 
@@ -1778,7 +2304,7 @@ class Graph(Common):
 
                         continue
 
-                graph.append( node.to_string()+'\n' )
+                yield node.to_string()+'\n'
 
             elif obj['type'] == 'edge':
 
@@ -1788,18 +2314,18 @@ class Graph(Common):
                         edge in edges_done):
                     continue
 
-                graph.append( edge.to_string() + '\n' )
+                yield edge.to_string() + '\n'
                 edges_done.add(edge)
 
             else:
 
                 sgraph = Subgraph(obj_dict=obj)
 
-                graph.append( sgraph.to_string()+'\n' )
+                for s in sgraph.iter_string():
+                    yield s
+                yield '\n'
 
-        graph.append( '}\n' )
-
-        return ''.join(graph)
+        yield '}\n'
 
 
 
@@ -2036,23 +2562,25 @@ class Dot(Graph):
         if prog is None:
             prog = self.prog
         if format == 'raw':
-            s = self.to_string()
-            if not PY3:
-                s = unicode(s)
             with io.open(path, mode='wt', encoding=encoding) as f:
-                f.write(s)
+                for s in self.iter_string():
+                    if not PY3:
+                        s = unicode(s)
+                    f.write(s)
         else:
             s = self.create(prog, format, encoding=encoding)
             with io.open(path, mode='wb') as f:
                 f.write(s)
         return True
 
-    def create(self, prog=None, format='ps', encoding=None):
+    def create(self, prog=None, format='ps', encoding=None,
+               timeout=None, cancel=None):
         """Creates and returns a binary image for the graph.
 
-        create will write the graph to a temporary dot file in the
-        encoding specified by `encoding` and process it with the
-        program given by 'prog' (which defaults to 'twopi'), reading
+        create will stream the graph into the stdin of the program
+        in the encoding specified by `encoding` (UTF-8 by default)
+        and process it with the program given by 'prog' (which
+        defaults to 'twopi'), reading
         the binary image output and return it as:
 
         - `str` of bytes in Python 2
@@ -2075,6 +2603,10 @@ class Dot(Graph):
 
             [ 'twopi', '-Tdot', '-s10' ]
 
+        The program is killed, raising InvocationException, if it
+        runs over 'timeout' seconds or when the threading.Event
+        'cancel' is set.
+
 
         @param prog: either:
 
@@ -2116,11 +2648,9 @@ class Dot(Graph):
         else:
             args = []
 
-        # temp file
-        tmp_fd, tmp_name = tempfile.mkstemp()
-        os.close(tmp_fd)
-        self.write(tmp_name, encoding=encoding)
-        tmp_dir = os.path.dirname(tmp_name)
+        # The dot script is streamed into the stdin of the program,
+        # only the shape files need the temp directory.
+        tmp_dir = tempfile.gettempdir()
 
         # For each of the image files...
         for img in self.shape_files:
@@ -2134,13 +2664,17 @@ class Dot(Graph):
             f.write(f_data)
             f.close()
 
-        arguments = ['-T{}'.format(format), ] + args + [tmp_name]
+        arguments = ['-T{}'.format(format), ] + args
 
         try:
             stdout_data, stderr_data, process = call_graphviz(
                 program=prog,
                 arguments=arguments,
                 working_dir=tmp_dir,
+                input_fragments=self.iter_string(),
+                input_encoding=encoding,
+                timeout=timeout,
+                cancel=cancel,
             )
         except OSError as e:
             if e.errno == errno.ENOENT:
@@ -2155,7 +2689,17 @@ class Dot(Graph):
         for img in self.shape_files:
             os.unlink(os.path.join(tmp_dir, os.path.basename(img)))
 
-        os.unlink(tmp_name)
+        # Graphviz reports its warnings on stderr even if it succeeds.
+        self.graphviz_stats = {
+            'prog': prog,
+            'format': format,
+            'time': process.wall_time,
+            'max_rss': process.max_rss,
+            'warnings': [
+                line for line in
+                stderr_data.decode('utf-8', 'replace').splitlines()
+                if line.strip()],
+        }
 
         if process.returncode != 0:
             message = (
@@ -8,15 +8,20 @@ Published under Apache 2.0 License (http://www.apache.org/licenses/LICENSE-2.0.h
 This file mainly used to generate resource used in DE.
 '''
 
-import colorbrewer, types
+import types
 import AttrsDef
 import ExtGraph, ExtParser
 from DEUtils import add_double_quote
 import DEUtils
-import math, numpy, cv2
+import math, os, sys
 import wx
 
+### colorbrewer, numpy and cv2 are imported by the generators using them, the 
+### build scripts run "python tools.py sprite" without them.
+
 def build_CB_dict():
+    import colorbrewer
+    
     __all_stuff = dir(colorbrewer)
     c_dict = {}
     for s in __all_stuff:
@@ -70,6 +75,8 @@ def generate_arrowtype_images():
     return
 
 def generate_platte():
+    import numpy, cv2
+    
     max_w, max_h = 90, 120
     
     all_files = []
@@ -156,11 +163,64 @@ def generate_platte():
 
     return
         
+def generate_sprite_atlas(item_type, attr_name, values):
+    '''Pack the normalized images of values into one atlas png with an index csv, 
+    read by DEUtils.load_sprite_list().'''
+    
+    category = DEUtils.IMAGE_CATEGORY[(item_type, attr_name)]
+    
+    image_list = [ DEUtils.get_image_resource(item_type, attr_name, v) for v in values ]
+    max_w, max_h = DEUtils.get_max_image_size(image_list)
+    
+    fn = DEUtils.SPRITE_FILE%category
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    
+    cols = int(math.ceil(math.sqrt(len(image_list))))
+    rows = int(math.ceil(len(image_list)/float(cols)))
+    
+    atlas = wx.Image(cols*max_w, rows*max_h)
+    atlas.Clear()
+    if any( img.HasAlpha() for img in image_list ):
+        atlas.InitAlpha()
+    
+    out_f = open(DEUtils.SPRITE_INDEX_FILE%category, 'w')
+    for i in range(len(image_list)):
+        x = (i%cols)*max_w
+        y = int(i/cols)*max_h
+        img = DEUtils.normalize_image(image_list[i], max_w, max_h)
+        if atlas.HasAlpha() and not img.HasAlpha():
+            img.InitAlpha()
+        atlas.Paste(img, x, y)
+        out_f.write("%s,%d,%d,%d,%d\n"%(values[i], x, y, max_w, max_h))
+    out_f.close()
+    
+    atlas.SaveFile(fn, wx.BITMAP_TYPE_PNG)
+    
+    return
+
+def generate_all_sprite_atlas():
+    
+    app = wx.App(False)
+    
+    generate_sprite_atlas('node', 'shape', AttrsDef.E_SHAPE)
+    generate_sprite_atlas('edge', 'arrowhead', AttrsDef.E_ARROWTYPE)
+    generate_sprite_atlas(None, 'colorscheme', AttrsDef.E_COLORSCHEME)
+    
+    app.Destroy()
+    
+    return
+        
 if __name__ == '__main__':
+    if sys.argv[1:] == ['sprite']: ### Run by build.bat and build_mac.sh.
+        generate_all_sprite_atlas()
+        sys.exit(0)
+    
     #generate_node_shape_images()
     #store_colorbrewer()
     #generate_platte()
     generate_arrowtype_images()
+    generate_all_sprite_atlas()
     pass
     
     